@@ -1,15 +1,30 @@
+import os
 import sys
 import time
+import queue
+import shlex
+import socket
+import asyncio
+import subprocess
+import contextlib
+import multiprocessing
 import random
 import timeit
 import math
 import argparse
-from collections import Counter
+from collections import Counter, OrderedDict
 from copy import deepcopy
 import pickle
+import numpy as np
 
-BOARD_ROWS = 5
+from value_table import ValueTable, save_policy, load_policy, convert_policy, backup_episodes
+from instrumentation import Instrumentation, clock
+from replay_buffer import ReplayBuffer
+from checkpoint import Checkpointer, load_checkpoint
+
+BOARD_ROWS = 5  # Default board size
 BOARD_COLS = 5
+BOARD_SIZES = range(5, 20)  # Sizes accepted on the command line
 
 
 # from .read import *
@@ -72,21 +87,289 @@ def readOutput(path="output.txt"):
     return "MOVE", x, y
 
 
+def popcount(mask):
+    return bin(mask).count('1')
+
+
+BLACK_DIGITS = str.maketrans('012', '010')
+WHITE_DIGITS = str.maketrans('012', '001')
+
+
+class BoardTables:
+    def __init__(self, n):
+        '''
+        Precomputed bit masks for an n*n bitboard. Point (i, j) is stored at bit i * n + j.
+
+        :param n: size of the board n*n
+        '''
+        self.size = n
+        self.full = (1 << (n * n)) - 1
+        left_col = 0
+        for i in range(n):
+            left_col |= 1 << (i * n)
+        self.not_left = self.full & ~left_col  # Points that can shift one column left
+        self.not_right = self.full & ~(left_col << (n - 1))  # Points that can shift one column right
+        self.coords = [(p // n, p % n) for p in range(n * n)]
+        self.neighbor_masks = [self.dilate(1 << p) & ~(1 << p) for p in range(n * n)]
+        self.neighbor_points = [self.points(mask) for mask in self.neighbor_masks]
+        self.neighbor_coords = [[self.coords[q] for q in points] for points in self.neighbor_points]
+        # Zobrist keys, seeded by the size so that saved policies stay valid between runs
+        rng = random.Random('zobrist-{}'.format(n))
+        self.zobrist = [[0] * (n * n)] + [[rng.getrandbits(64) for p in range(n * n)] for piece_type in (1, 2)]
+        self.zobrist_turn = rng.getrandbits(64)  # Mixed in when 'O' is to move
+        # The 8 rotations and reflections of the board, symmetries[t][p] is the image of point p
+        maps = [lambda i, j: (i, j), lambda i, j: (j, n - 1 - i), lambda i, j: (n - 1 - i, n - 1 - j),
+                lambda i, j: (n - 1 - j, i), lambda i, j: (i, n - 1 - j), lambda i, j: (j, i),
+                lambda i, j: (n - 1 - i, j), lambda i, j: (n - 1 - j, n - 1 - i)]
+        self.symmetries = [[a * n + b for a, b in (f(i, j) for i, j in self.coords)] for f in maps]
+        # Zobrist keys of the 16 symmetric boards packed in one integer, 64 bits per lane:
+        # lane t hashes the board mapped by symmetries[t], lane 8 + t the same with the colors swapped
+        self.symmetry_keys = [[0] * (n * n)] + [[0] * (n * n) for piece_type in (1, 2)]
+        for piece_type in (1, 2):
+            for p in range(n * n):
+                packed = 0
+                for t, perm in enumerate(self.symmetries):
+                    packed |= self.zobrist[piece_type][perm[p]] << (64 * t)
+                    packed |= self.zobrist[3 - piece_type][perm[p]] << (64 * (8 + t))
+                self.symmetry_keys[piece_type][p] = packed
+        # Per lane XOR of the turn key, indexed by the player to move, for canonical_keys
+        self.turn_lanes = [None] + [np.array([self.zobrist_turn if (lane >= 8) != (piece_type == 2) else 0
+                                              for lane in range(16)], dtype=np.uint64) for piece_type in (1, 2)]
+
+    def dilate(self, mask):
+        '''
+        Grow a mask by one step in the four directions.
+
+        :param mask: bit mask of points.
+        :return: the mask together with all of its neighbors.
+        '''
+        n = self.size
+        return (mask | ((mask & self.not_right) << 1) | ((mask & self.not_left) >> 1)
+                | ((mask << n) & self.full) | (mask >> n))
+
+    def neighbors(self, mask):
+        '''
+        Get the points next to a mask in the four directions.
+
+        :param mask: bit mask of points.
+        :return: bit mask of the points having a neighbor in mask, which may include points of mask.
+        '''
+        n = self.size
+        return (((mask & self.not_right) << 1) | ((mask & self.not_left) >> 1)
+                | ((mask << n) & self.full) | (mask >> n))
+
+    def flood(self, seed, within):
+        '''
+        Flood fill from seed without leaving within.
+
+        :param seed: bit mask to start from.
+        :param within: bit mask the fill is restricted to.
+        :return: bit mask of the connected region.
+        '''
+        region = seed
+        while True:
+            grown = self.dilate(region) & within
+            if grown == region:
+                return region
+            region = grown
+
+    def points(self, mask):
+        '''
+        List the point indices set in a mask.
+
+        :param mask: bit mask of points.
+        :return: a list of point indices.
+        '''
+        points = []
+        while mask:
+            low = mask & -mask
+            points.append(low.bit_length() - 1)
+            mask ^= low
+        return points
+
+    def hash_mask(self, mask, piece_type):
+        '''
+        XOR together the Zobrist keys of the stones in a mask.
+
+        :param mask: bit mask of points.
+        :param piece_type: 1('X') or 2('O').
+        :return: 64-bit hash.
+        '''
+        keys = self.zobrist[piece_type]
+        h = 0
+        for p in self.points(mask):
+            h ^= keys[p]
+        return h
+
+    def hash_stones(self, stones):
+        return self.hash_mask(stones[1], 1) ^ self.hash_mask(stones[2], 2)
+
+    def hash_symmetries(self, stones):
+        '''
+        Get the packed Zobrist hashes of the 16 symmetric boards of a position.
+
+        :param stones: [unused, mask of 'X' pieces, mask of 'O' pieces].
+        :return: integer holding 16 lanes of 64 bits.
+        '''
+        h = 0
+        for piece_type in (1, 2):
+            keys = self.symmetry_keys[piece_type]
+            for p in self.points(stones[piece_type]):
+                h ^= keys[p]
+        return h
+
+    def canonical_key(self, symmetry_hash, piece_type):
+        '''
+        Get the key shared by a position and all of its rotations, reflections and color swaps.
+
+        :param symmetry_hash: packed hashes from hash_symmetries.
+        :param piece_type: 1('X') or 2('O'), the player to move.
+        :return: smallest of the 16 keys.
+        '''
+        turn = self.zobrist_turn
+        best = None
+        for lane in range(16):
+            h = (symmetry_hash >> (64 * lane)) & 0xFFFFFFFFFFFFFFFF
+            # Swapping the colors also swaps the player to move
+            if (lane >= 8) != (piece_type == 2):
+                h ^= turn
+            if best is None or h < best:
+                best = h
+        return best
+
+    def canonical_keys(self, symmetry_hashes, piece_type):
+        '''
+        Vectorized canonical_key for many positions with the same player to move.
+
+        :param symmetry_hashes: list of packed hashes from hash_symmetries.
+        :param piece_type: 1('X') or 2('O'), the player to move.
+        :return: uint64 array of keys.
+        '''
+        lanes = np.frombuffer(b''.join(h.to_bytes(128, 'little') for h in symmetry_hashes), dtype='<u8')
+        return (lanes.reshape(-1, 16) ^ self.turn_lanes[piece_type]).min(axis=1)
+
+    def to_coords(self, mask):
+        coords = self.coords
+        return [coords[p] for p in self.points(mask)]
+
+    def to_mask(self, positions):
+        n = self.size
+        mask = 0
+        for piece in positions:
+            mask |= 1 << (piece[0] * n + piece[1])
+        return mask
+
+    def to_board(self, stones):
+        '''
+        Expand per color bit masks into a list of lists board.
+
+        :param stones: [unused, mask of 'X' pieces, mask of 'O' pieces].
+        :return: board with 0 for empty, 1 for 'X' and 2 for 'O'.
+        '''
+        n = self.size
+        black, white = stones[1], stones[2]
+        board = []
+        for i in range(n):
+            row = []
+            for j in range(n):
+                bit = 1 << (i * n + j)
+                row.append(1 if black & bit else 2 if white & bit else 0)
+            board.append(row)
+        return board
+
+    def from_digits(self, digits):
+        '''
+        Pack a board written as n*n digits, row after row as the referee lines send it, into per color bit masks.
+
+        :param digits: string of 0 for empty, 1 for 'X' and 2 for 'O'.
+        :return: [0, mask of 'X' pieces, mask of 'O' pieces].
+        '''
+        if len(digits) != self.size * self.size or digits.strip('012'):
+            raise ValueError('Not a {0}x{0} board: {1}'.format(self.size, digits))
+        # Point p is character p, the reversed string reads as binary numbers once the other color is blanked
+        reverse = digits[::-1]
+        return [0, int(reverse.translate(BLACK_DIGITS), 2), int(reverse.translate(WHITE_DIGITS), 2)]
+
+    def from_board(self, board):
+        '''
+        Pack a list of lists board into per color bit masks.
+
+        :param board: board with 0 for empty, 1 for 'X' and 2 for 'O'.
+        :return: [0, mask of 'X' pieces, mask of 'O' pieces].
+        '''
+        n = self.size
+        stones = [0, 0, 0]
+        for i in range(n):
+            for j in range(n):
+                if board[i][j]:
+                    stones[board[i][j]] |= 1 << (i * n + j)
+        return stones
+
+
+_board_tables = {}
+
+
+def board_tables(n):
+    '''
+    Get the shared BoardTables of a board size, building them on first use.
+
+    :param n: size of the board n*n
+    :return: BoardTables instance.
+    '''
+    tables = _board_tables.get(n)
+    if tables is None:
+        tables = _board_tables[n] = BoardTables(n)
+    return tables
+
+
 class GO:
     def __init__(self, n):
         """
         Go game.
 
+        The position is kept as one bit mask per color (bit i * n + j for point (i, j)),
+        so liberty checks, captures and board comparisons are a few bitwise operations.
+        board and previous_board are still available as list of lists views.
+
+        Groups are tracked incrementally with a union-find over the points: every stone
+        points to its parent and each root holds the stones and liberties of its group.
+
         :param n: size of the board n*n
         """
         self.size = n
+        self.tables = board_tables(n)
         # self.previous_board = None # Store the previous board
+        self.stones = [0, 0, 0]  # Bit masks indexed by piece type, index 0 unused
+        self.previous_stones = [0, 0, 0]
+        self.previous_hash = 0
+        self.superko = False  # Forbid any repeat of an earlier position of the game, not only the simple KO
+        self.area_scoring = False  # Count the empty regions surrounded by one color as its points, not only the stones
+        self.reset_groups()
         self.X_move = True  # X chess plays first
         self.died_pieces = []  # Intialize died pieces to be empty
         self.n_move = 0  # Trace the number of moves
         self.max_move = n * n - 1  # The max movement of a Go game
         self.komi = n / 2  # Komi rule
         self.verbose = False  # Verbose only when there is a manual player
+        self.stats = None  # Instrumentation timing the phases of play, None when off
+
+    @property
+    def board(self):
+        return self.tables.to_board(self.stones)
+
+    @board.setter
+    def board(self, board):
+        self.stones = self.tables.from_board(board)
+        self.reset_groups()
+
+    @property
+    def previous_board(self):
+        return self.tables.to_board(self.previous_stones)
+
+    @previous_board.setter
+    def previous_board(self, board):
+        self.previous_stones = self.tables.from_board(board)
+        self.previous_hash = self.tables.hash_stones(self.previous_stones)
 
     def init_board(self, n):
         '''
@@ -95,11 +378,12 @@ class GO:
         :param n: width and height of the board.
         :return: None.
         '''
-        board = [[0 for x in range(n)] for y in range(n)]  # Empty space marked as 0
         # 'X' pieces marked as 1
         # 'O' pieces marked as 2
-        self.board = board
-        self.previous_board = deepcopy(board)
+        self.stones = [0, 0, 0]
+        self.previous_stones = [0, 0, 0]
+        self.previous_hash = 0
+        self.reset_groups()
         self.n_move = 0
 
     def set_board(self, piece_type, previous_board, board):
@@ -113,14 +397,285 @@ class GO:
         # 'X' pieces marked as 1
         # 'O' pieces marked as 2
 
-        for i in range(self.size):
-            for j in range(self.size):
-                if previous_board[i][j] == piece_type and board[i][j] != piece_type:
-                    self.died_pieces.append((i, j))
-
-        # self.piece_type = piece_type
         self.previous_board = previous_board
         self.board = board
+        died = self.previous_stones[piece_type] & ~self.stones[piece_type]
+        self.died_pieces.extend(self.tables.to_coords(died))
+
+    def set_stones(self, piece_type, previous_stones, stones):
+        '''
+        Initialize board status from bit masks, as set_board does from boards, for a player about to move.
+
+        :param piece_type: 1('X') or 2('O').
+        :param previous_stones: [0, 'X' mask, 'O' mask] of the previous board.
+        :param stones: [0, 'X' mask, 'O' mask] of the current board.
+        :return: None.
+        '''
+        self.previous_stones = previous_stones
+        self.previous_hash = self.tables.hash_stones(previous_stones)
+        self.stones = stones
+        self.reset_groups()
+        self.died_pieces = self.tables.to_coords(previous_stones[piece_type] & ~stones[piece_type])
+
+    def reset_groups(self):
+        '''
+        Rebuild the group structure from the stone masks.
+
+        :param: None.
+        :return: None.
+        '''
+        tables = self.tables
+        points = self.size * self.size
+        self.parent = [-1] * points  # Union-find parent of every stone, -1 on empty points
+        self.group_size = [0] * points  # Number of stones, valid at group roots
+        self.group_stones = [0] * points  # Bit mask of the stones, valid at group roots
+        self.group_libs = [0] * points  # Bit mask of the liberties, valid at group roots
+        self.last_move = None  # Point of the last stone placed, captures are searched around it
+        self.undo_stack = []  # One entry per move played with apply_move
+        self.trail = []  # (values, index, old value) of every group change made under apply_move
+        self.position_hash = tables.hash_stones(self.stones)  # Zobrist hash of the stones
+        self.symmetry_hash = tables.hash_symmetries(self.stones)  # Hashes of the 16 symmetric boards, packed
+        self.history = Counter([self.position_hash])  # Hashes of the positions seen, used by the superko rule
+        self.stone_count = [0, popcount(self.stones[1]), popcount(self.stones[2])]  # Stones on the board per color
+        # Legality cache per piece type: points passing the liberty rule, the subset of them that only
+        # get a liberty by capturing (KO candidates), and the points to check again before use
+        self.legal = [0, 0, 0]
+        self.capture_only = [0, 0, 0]
+        self.dirty = [0, tables.full, tables.full]
+        empty = tables.full & ~(self.stones[1] | self.stones[2])
+        for piece_type in (1, 2):
+            own = self.stones[piece_type]
+            remaining = own
+            while remaining:
+                low = remaining & -remaining
+                group = tables.flood(low, own)
+                root = low.bit_length() - 1
+                for p in tables.points(group):
+                    self.parent[p] = root
+                self.group_size[root] = popcount(group)
+                self.group_stones[root] = group
+                self.group_libs[root] = tables.dilate(group) & empty
+                remaining &= ~group
+
+    def canonical_key(self, piece_type):
+        '''
+        Get the key of the current position that is shared with its rotations, reflections and color swaps.
+
+        :param piece_type: 1('X') or 2('O'), the player to move.
+        :return: 64-bit hash.
+        '''
+        return self.tables.canonical_key(self.symmetry_hash, piece_type)
+
+    def afterstate_keys(self, positions, piece_type):
+        '''
+        Get the canonical keys of the positions after each of the given moves, captures included,
+        with the opponent to move. The keys are derived from the current hash without playing the moves.
+
+        :param positions: list of valid placements (row, column).
+        :param piece_type: 1('X') or 2('O'), the player moving.
+        :return: uint64 array of keys, one per position.
+        '''
+        tables = self.tables
+        n = self.size
+        parent = self.parent
+        group_libs = self.group_libs
+        opponent = self.stones[3 - piece_type]
+        keys = tables.symmetry_keys[piece_type]
+        opponent_keys = tables.symmetry_keys[3 - piece_type]
+        captures = {}  # root -> hash of its stones, for the groups in atari
+        hashes = []
+        for i, j in positions:
+            p = i * n + j
+            bit = 1 << p
+            h = self.symmetry_hash ^ keys[p]
+            seen = []
+            for q in tables.neighbor_points[p]:
+                if not opponent >> q & 1:
+                    continue
+                r = self.find_group(q)
+                if group_libs[r] != bit or r in seen:
+                    continue
+                seen.append(r)
+                if r not in captures:
+                    captured = 0
+                    for s in tables.points(self.group_stones[r]):
+                        captured ^= opponent_keys[s]
+                    captures[r] = captured
+                h ^= captures[r]
+            hashes.append(h)
+        return tables.canonical_keys(hashes, 3 - piece_type)
+
+    def remember_position(self):
+        '''
+        Store the current position as the previous board before a move.
+
+        :param: None.
+        :return: None.
+        '''
+        self.previous_stones = self.stones[:]
+        self.previous_hash = self.position_hash
+
+    def find_group(self, p):
+        '''
+        Find the root of the group holding the stone at point p.
+
+        :param p: point index i * n + j, must hold a stone.
+        :return: point index of the group root.
+        '''
+        parent = self.parent
+        while parent[p] != p:
+            p = parent[p]
+        return p
+
+    def set_group_value(self, values, index, value):
+        '''
+        Change one entry of the group structure, remembering the old value while a move can be undone.
+
+        :param values: one of parent, group_size, group_stones or group_libs.
+        :param index: point index.
+        :param value: new value.
+        :return: None.
+        '''
+        if self.undo_stack:
+            self.trail.append((values, index, values[index]))
+        values[index] = value
+
+    def union_groups(self, a, b):
+        '''
+        Merge two groups, the smaller one goes under the larger one.
+
+        :param a: root of the first group.
+        :param b: root of the second group.
+        :return: root of the merged group.
+        '''
+        if self.group_size[a] < self.group_size[b]:
+            a, b = b, a
+        set_value = self.set_group_value
+        set_value(self.parent, b, a)
+        set_value(self.group_size, a, self.group_size[a] + self.group_size[b])
+        set_value(self.group_stones, a, self.group_stones[a] | self.group_stones[b])
+        set_value(self.group_libs, a, self.group_libs[a] | self.group_libs[b])
+        return a
+
+    def add_stone(self, p, piece_type):
+        '''
+        Put a stone on an empty point and merge it with the groups around it.
+        Opponent groups left without liberty stay on the board until remove_died_pieces.
+
+        :param p: point index i * n + j.
+        :param piece_type: 1('X') or 2('O').
+        :return: None.
+        '''
+        tables = self.tables
+        parent = self.parent
+        group_libs = self.group_libs
+        set_value = self.set_group_value
+        bit = 1 << p
+        self.stones[piece_type] |= bit
+        self.stone_count[piece_type] += 1
+        self.position_hash ^= tables.zobrist[piece_type][p]
+        self.symmetry_hash ^= tables.symmetry_keys[piece_type][p]
+        own = self.stones[piece_type]
+        set_value(parent, p, p)
+        set_value(self.group_size, p, 1)
+        set_value(self.group_stones, p, bit)
+        set_value(group_libs, p, tables.neighbor_masks[p] & ~(own | self.stones[3 - piece_type]))
+        root = p
+        changed = bit | tables.neighbor_masks[p]
+        for q in tables.neighbor_points[p]:
+            if parent[q] < 0:
+                continue
+            r = self.find_group(q)
+            if group_libs[r] & bit:
+                set_value(group_libs, r, group_libs[r] & ~bit)
+            if own >> q & 1:
+                if r != root:
+                    root = self.union_groups(root, r)
+            else:
+                changed |= group_libs[r]
+        # The legality of the points around the stone and on the liberties of the groups it touched may change
+        changed |= group_libs[root]
+        dirty = self.dirty
+        dirty[1] |= changed
+        dirty[2] |= changed
+        self.last_move = p
+
+    def remove_group(self, root):
+        '''
+        Take a group off the board and give its points back as liberties to the groups around it.
+
+        :param root: root of the group.
+        :return: bit mask of the removed stones.
+        '''
+        tables = self.tables
+        parent = self.parent
+        set_value = self.set_group_value
+        group = self.group_stones[root]
+        piece_type = 1 if self.stones[1] & group else 2
+        self.stones[piece_type] &= ~group
+        self.stone_count[piece_type] -= self.group_size[root]
+        keys = tables.zobrist[piece_type]
+        symmetry_keys = tables.symmetry_keys[piece_type]
+        for p in tables.points(group):
+            set_value(parent, p, -1)
+            self.position_hash ^= keys[p]
+            self.symmetry_hash ^= symmetry_keys[p]
+        changed = tables.dilate(group)
+        adjacent = changed & self.stones[3 - piece_type]
+        while adjacent:
+            low = adjacent & -adjacent
+            r = self.find_group(low.bit_length() - 1)
+            set_value(self.group_libs, r, self.group_libs[r] | tables.dilate(self.group_stones[r]) & group)
+            changed |= self.group_libs[r]
+            adjacent &= ~self.group_stones[r]
+        dirty = self.dirty
+        dirty[1] |= changed
+        dirty[2] |= changed
+        return group
+
+    def apply_move(self, i, j, piece_type):
+        '''
+        Play a move in place, capturing the dead opponent stones, so that it can be taken back with undo_move.
+        Moves can be stacked and are undone in reverse order.
+
+        :param i: row number of the board.
+        :param j: column number of the board.
+        :param piece_type: 1('X') or 2('O').
+        :return: locations of the captured pieces, or None if the placement is invalid.
+        '''
+        if not self.valid_place_check(i, j, piece_type, test_check=True):
+            return None
+        stones = self.stones
+        self.undo_stack.append((stones[1], stones[2], self.position_hash, self.symmetry_hash,
+                                self.previous_stones, self.previous_hash, self.died_pieces, self.last_move,
+                                self.stone_count[:], self.legal[:], self.capture_only[:], self.dirty[:],
+                                len(self.trail)))
+        self.remember_position()
+        self.add_stone(i * self.size + j, piece_type)
+        self.died_pieces = self.remove_died_pieces(3 - piece_type)
+        self.history[self.position_hash] += 1
+        return self.died_pieces
+
+    def undo_move(self):
+        '''
+        Take back the last move played with apply_move, restoring the placed and captured stones.
+
+        :param: None.
+        :return: None.
+        '''
+        history = self.history
+        history[self.position_hash] -= 1
+        if not history[self.position_hash]:
+            del history[self.position_hash]
+        (black, white, self.position_hash, self.symmetry_hash, self.previous_stones, self.previous_hash,
+         self.died_pieces, self.last_move, self.stone_count, self.legal, self.capture_only, self.dirty,
+         mark) = self.undo_stack.pop()
+        self.stones[1] = black
+        self.stones[2] = white
+        trail = self.trail
+        while len(trail) > mark:
+            values, index, value = trail.pop()
+            values[index] = value
 
     def compare_board(self, board1, board2):
         for i in range(self.size):
@@ -146,14 +701,7 @@ class GO:
         :param j: column number of the board.
         :return: a list containing the neighbors row and column (row, column) of position (i, j).
         '''
-        board = self.board
-        neighbors = []
-        # Detect borders and add neighbor coordinates
-        if i > 0: neighbors.append((i - 1, j))
-        if i < len(board) - 1: neighbors.append((i + 1, j))
-        if j > 0: neighbors.append((i, j - 1))
-        if j < len(board) - 1: neighbors.append((i, j + 1))
-        return neighbors
+        return list(self.tables.neighbor_coords[i * self.size + j])
 
     def detect_neighbor_ally(self, i, j):
         '''
@@ -163,34 +711,42 @@ class GO:
         :param j: column number of the board.
         :return: a list containing the neighbored allies row and column (row, column) of position (i, j).
         '''
-        board = self.board
-        neighbors = self.detect_neighbor(i, j)  # Detect neighbors
-        group_allies = []
-        # Iterate through neighbors
-        for piece in neighbors:
-            # Add to allies list if having the same color
-            if board[piece[0]][piece[1]] == board[i][j]:
-                group_allies.append(piece)
-        return group_allies
+        p = i * self.size + j
+        return self.tables.to_coords(self.tables.neighbor_masks[p] & self.color_mask(p))
+
+    def color_mask(self, p):
+        '''
+        Get the mask of points with the same content (empty, 'X' or 'O') as point p.
+
+        :param p: point index i * n + j.
+        :return: bit mask.
+        '''
+        bit = 1 << p
+        for piece_type in (1, 2):
+            if self.stones[piece_type] & bit:
+                return self.stones[piece_type]
+        return self.tables.full & ~(self.stones[1] | self.stones[2])
+
+    def group_mask(self, p):
+        '''
+        Get the mask of the connected group containing point p.
+
+        :param p: point index i * n + j.
+        :return: bit mask of the group.
+        '''
+        if self.parent[p] >= 0:
+            return self.group_stones[self.find_group(p)]
+        return self.tables.flood(1 << p, self.color_mask(p))
 
     def ally_dfs(self, i, j):
         '''
-        Using DFS to search for all allies of a given stone.
+        Search for all allies of a given stone.
 
         :param i: row number of the board.
         :param j: column number of the board.
         :return: a list containing the all allies row and column (row, column) of position (i, j).
         '''
-        stack = [(i, j)]  # stack for DFS serach
-        ally_members = []  # record allies positions during the search
-        while stack:
-            piece = stack.pop()
-            ally_members.append(piece)
-            neighbor_allies = self.detect_neighbor_ally(piece[0], piece[1])
-            for ally in neighbor_allies:
-                if ally not in stack and ally not in ally_members:
-                    stack.append(ally)
-        return ally_members
+        return self.tables.to_coords(self.group_mask(i * self.size + j))
 
     def find_liberty(self, i, j):
         '''
@@ -200,16 +756,33 @@ class GO:
         :param j: column number of the board.
         :return: boolean indicating whether the given stone still has liberty.
         '''
-        board = self.board
-        ally_members = self.ally_dfs(i, j)
-        for member in ally_members:
-            neighbors = self.detect_neighbor(member[0], member[1])
-            for piece in neighbors:
-                # If there is empty space around a piece, it has liberty
-                if board[piece[0]][piece[1]] == 0:
-                    return True
-        # If none of the pieces in a allied group has an empty space, it has no liberty
-        return False
+        p = i * self.size + j
+        if self.parent[p] >= 0:
+            return self.group_libs[self.find_group(p)] != 0
+        empty = self.tables.full & ~(self.stones[1] | self.stones[2])
+        return self.tables.dilate(self.group_mask(p)) & empty != 0
+
+    def dead_groups(self, piece_type):
+        '''
+        Find the groups of a given piece type that have no liberty.
+        Only the groups next to the last move can have lost their last liberty,
+        the whole board is searched when there is no last move.
+
+        :param piece_type: 1('X') or 2('O').
+        :return: a list containing the roots of the dead groups.
+        '''
+        if self.last_move is None:
+            candidates = self.stones[piece_type]
+        else:
+            candidates = self.tables.neighbor_masks[self.last_move] & self.stones[piece_type]
+        roots = []
+        while candidates:
+            low = candidates & -candidates
+            r = self.find_group(low.bit_length() - 1)
+            if not self.group_libs[r]:
+                roots.append(r)
+            candidates &= ~self.group_stones[r]
+        return roots
 
     def find_died_pieces(self, piece_type):
         '''
@@ -218,17 +791,10 @@ class GO:
         :param piece_type: 1('X') or 2('O').
         :return: a list containing the dead pieces row and column(row, column).
         '''
-        board = self.board
-        died_pieces = []
-
-        for i in range(len(board)):
-            for j in range(len(board)):
-                # Check if there is a piece at this position:
-                if board[i][j] == piece_type:
-                    # The piece die if it has no liberty
-                    if not self.find_liberty(i, j):
-                        died_pieces.append((i, j))
-        return died_pieces
+        dead = 0
+        for r in self.dead_groups(piece_type):
+            dead |= self.group_stones[r]
+        return self.tables.to_coords(dead)
 
     def remove_died_pieces(self, piece_type):
         '''
@@ -238,10 +804,12 @@ class GO:
         :return: locations of dead pieces.
         '''
 
-        died_pieces = self.find_died_pieces(piece_type)
-        if not died_pieces: return []
-        self.remove_certain_pieces(died_pieces)
-        return died_pieces
+        roots = self.dead_groups(piece_type)
+        if not roots: return []
+        dead = 0
+        for r in roots:
+            dead |= self.remove_group(r)
+        return self.tables.to_coords(dead)
 
     def remove_certain_pieces(self, positions):
         '''
@@ -250,10 +818,10 @@ class GO:
         :param positions: a list containing the pieces to be removed row and column(row, column)
         :return: None.
         '''
-        board = self.board
-        for piece in positions:
-            board[piece[0]][piece[1]] = 0
-        self.update_board(board)
+        keep = ~self.tables.to_mask(positions)
+        self.stones[1] &= keep
+        self.stones[2] &= keep
+        self.reset_groups()
 
     def place_chess(self, i, j, piece_type):
         '''
@@ -264,19 +832,16 @@ class GO:
         :param piece_type: 1('X') or 2('O').
         :return: boolean indicating whether the placement is valid.
         '''
-        board = self.board
-
         valid_place = self.valid_place_check(i, j, piece_type)
         if not valid_place:
             return False
-        self.previous_board = deepcopy(board)
-        board[i][j] = piece_type
-        self.update_board(board)
+        self.remember_position()
+        self.add_stone(i * self.size + j, piece_type)
         # Remove the following line for HW2 CS561 S2020
         # self.n_move += 1
         return True
 
-    def valid_place_check(self, i, j, piece_type, test_check=False):
+    def valid_place_check(self, i, j, piece_type, test_check=False, verbose=None):
         '''
         Check whether a placement is valid.
 
@@ -284,54 +849,120 @@ class GO:
         :param j: column number of the board.
         :param piece_type: 1(white piece) or 2(black piece).
         :param test_check: boolean if it's a test check.
+        :param verbose: print why a placement is invalid, the board's own setting by default.
         :return: boolean indicating whether the placement is valid.
         '''
-        board = self.board
-        verbose = self.verbose
+        tables = self.tables
+        n = self.size
+        if verbose is None:
+            verbose = self.verbose
         if test_check:
             verbose = False
 
         # Check if the place is in the board range
-        if not (i >= 0 and i < len(board)):
+        if not (i >= 0 and i < n):
             if verbose:
-                print(('GO:Invalid placement. row should be in the range 1 to {}.').format(len(board) - 1))
+                print(('GO:Invalid placement. row should be in the range 1 to {}.').format(n - 1))
             return False
-        if not (j >= 0 and j < len(board)):
+        if not (j >= 0 and j < n):
             if verbose:
-                print(('GO:Invalid placement. column should be in the range 1 to {}.').format(len(board) - 1))
+                print(('GO:Invalid placement. column should be in the range 1 to {}.').format(n - 1))
             return False
 
         # Check if the place already has a piece
-        if board[i][j] != 0:
+        p = i * n + j
+        bit = 1 << p
+        own = self.stones[piece_type]
+        opponent = self.stones[3 - piece_type]
+        if (own | opponent) & bit:
             if verbose:
                 print('GO:Invalid placement. There is already a chess in this position.')
             return False
 
-        # Copy the board for testing
-        test_go = self.copy_board()
-        test_board = test_go.board
-
-        # Check if the place has liberty
-        test_board[i][j] = piece_type
-        test_go.update_board(test_board)
-        if test_go.find_liberty(i, j):
+        # Check if the place has liberty, looking only at the groups around it
+        liberty, captured = self.placement_liberties(p, piece_type)
+        if liberty and not self.superko:
             return True
 
-        # If not, remove the died pieces of opponent and check again
-        test_go.remove_died_pieces(3 - piece_type)
-        if not test_go.find_liberty(i, j):
+        # If not, the died pieces of opponent must give it a liberty
+        if not liberty and not captured:
             if verbose:
                 print('GO:Invalid placement. No liberty found in this position.')
             return False
 
         # Check special case: repeat placement causing the repeat board state (KO rule)
         else:
-            if self.died_pieces and self.compare_board(self.previous_board, test_go.board):
+            after = self.position_hash ^ tables.zobrist[piece_type][p]
+            if captured:
+                after ^= tables.hash_mask(captured, 3 - piece_type)
+            if self.superko:
+                repeat = after in self.history
+            else:
+                repeat = self.died_pieces and after == self.previous_hash
+            if repeat:
                 if verbose:
                     print('GO:Invalid placement. A repeat move not permitted by the KO rule.')
                 return False
         return True
 
+    def placement_liberties(self, p, piece_type):
+        '''
+        Look at the groups around an empty point to see where a stone placed there gets its liberties.
+
+        :param p: point index i * n + j, must be empty.
+        :param piece_type: 1('X') or 2('O').
+        :return: (mask of the liberties it would have before captures, mask of the stones it would capture).
+        '''
+        tables = self.tables
+        parent = self.parent
+        group_libs = self.group_libs
+        own = self.stones[piece_type]
+        bit = 1 << p
+        liberty = tables.neighbor_masks[p] & ~(own | self.stones[3 - piece_type])
+        captured = 0
+        for q in tables.neighbor_points[p]:
+            if parent[q] < 0:
+                continue
+            r = self.find_group(q)
+            if own >> q & 1:
+                liberty |= group_libs[r] & ~bit
+            elif group_libs[r] == bit and not captured & (1 << q):
+                captured |= self.group_stones[r]
+        return liberty, captured
+
+    def legal_moves(self, piece_type):
+        '''
+        Get the valid placements of a player, as valid_place_check would find them one by one.
+        Only the points near the stones added or removed since the last call are checked again,
+        the KO rule is then applied to the few points that need a capture to get a liberty.
+
+        :param piece_type: 1('X') or 2('O').
+        :return: bit mask of the valid placements.
+        '''
+        dirty = self.dirty[piece_type]
+        if dirty:
+            legal = self.legal[piece_type] & ~dirty
+            capture_only = self.capture_only[piece_type] & ~dirty
+            for p in self.tables.points(dirty & ~(self.stones[1] | self.stones[2])):
+                liberty, captured = self.placement_liberties(p, piece_type)
+                if liberty:
+                    legal |= 1 << p
+                elif captured:
+                    legal |= 1 << p
+                    capture_only |= 1 << p
+            self.legal[piece_type] = legal
+            self.capture_only[piece_type] = capture_only
+            self.dirty[piece_type] = 0
+        legal = self.legal[piece_type]
+        # Points where a repeat of the previous (or with superko, any earlier) position is possible
+        check = legal if self.superko else (self.capture_only[piece_type] if self.died_pieces else 0)
+        if check:
+            n = self.size
+            for p in self.tables.points(check):
+                if not self.valid_place_check(p // n, p % n, piece_type, test_check=True):
+                    legal &= ~(1 << p)
+        return legal
+
     def update_board(self, new_board):
         '''
         Update the board with new_board
@@ -374,36 +1005,59 @@ class GO:
         if self.n_move >= self.max_move:
             return True
         # Case 2: two players all pass the move.
-        if self.compare_board(self.previous_board, self.board) and action == "PASS":
+        if self.previous_hash == self.position_hash and action == "PASS":
             return True
         return False
 
     def score(self, piece_type):
         '''
-        Get score of a player by counting the number of stones.
+        Get score of a player by counting the number of stones, and its territory with area scoring.
 
         :param piece_type: 1('X') or 2('O').
-        :return: boolean indicating whether the game should end.
+        :return: score of the player.
         '''
+        if self.area_scoring:
+            return self.stone_count[piece_type] + self.territory()[piece_type]
+        return self.stone_count[piece_type]
 
-        board = self.board
-        cnt = 0
-        for i in range(self.size):
-            for j in range(self.size):
-                if board[i][j] == piece_type:
-                    cnt += 1
-        return cnt
+    def territory(self):
+        '''
+        Count the empty points of the regions bordered by a single color, flooding the empty points with bit masks.
+        Regions touching both colors, or none, belong to nobody.
+
+        :param: None.
+        :return: [0, territory of 'X', territory of 'O'].
+        '''
+        tables = self.tables
+        black, white = self.stones[1], self.stones[2]
+        territory = [0, 0, 0]
+        remaining = tables.full & ~(black | white)
+        while remaining:
+            region = tables.flood(remaining & -remaining, remaining)
+            border = tables.dilate(region)
+            if not border & white:
+                if border & black:
+                    territory[1] += popcount(region)
+            elif not border & black:
+                territory[2] += popcount(region)
+            remaining &= ~region
+        return territory
 
     def judge_winner(self):
         '''
-        Judge the winner of the game by number of pieces for each player.
+        Judge the winner of the game by number of pieces for each player,
+        adding the territories with area scoring.
 
         :param: None.
         :return: piece type of winner of the game (0 if it's a tie).
         '''
 
-        cnt_1 = self.score(1)
-        cnt_2 = self.score(2)
+        cnt_1 = self.stone_count[1]
+        cnt_2 = self.stone_count[2]
+        if self.area_scoring:
+            territory = self.territory()
+            cnt_1 += territory[1]
+            cnt_2 += territory[2]
         if cnt_1 > cnt_2 + self.komi:
             return 1
         elif cnt_1 < cnt_2 + self.komi:
@@ -421,6 +1075,9 @@ class GO:
         :return: piece type of winner of the game (0 if it's a tie).
         '''
         self.init_board(self.size)
+        # The players read this board directly, nothing is copied to them between moves
+        player1.watch(self)
+        player2.watch(self)
         # Print input hints and error message if there is a manual player
         if player1.type == 'manual' or player2.type == 'manual':
             self.verbose = True
@@ -429,6 +1086,7 @@ class GO:
                     # self.visualize_board()
 
         verbose = self.verbose
+        stats = self.stats
         # Game starts!
         while 1:
             piece_type = 1 if self.X_move else 2
@@ -438,18 +1096,11 @@ class GO:
                 result = self.judge_winner()
                 if verbose:
                     #                     print('Game ended.')
-                    if result == 0:
-                        #                         print('The game is a tie.')
-                        player1.feedReward(0.5)
-                        player2.feedReward(0.1)
-                    elif result == 1:
-                        #                         print("Reward to Player 1")
-                        player1.feedReward(1)
-                        player2.feedReward(0)
-                    elif result == 2:
-                        #                         print("Reward to Player 2")
-                        player1.feedReward(0)
-                        player2.feedReward(1)
+                    if stats is not None:
+                        start = clock()
+                    reward_players(player1, player2, result)
+                    if stats is not None:
+                        stats.add('reward', clock() - start)
 
                 #                     print('The winner is {}'.format('X' if result == 1 else 'O'))
                 return result
@@ -470,22 +1121,28 @@ class GO:
 
             if action != "PASS":
                 # If invalid input, continue the loop. Else it places a chess on the board.
+                if stats is not None:
+                    start = clock()
                 if not self.place_chess(action[0], action[1], piece_type):
                     if verbose:
                         self.visualize_board()
                     continue
+                if stats is not None:
+                    placed = clock()
+                    stats.add('place', placed - start)
                 self.died_pieces = self.remove_died_pieces(3 - piece_type)  # Remove the dead pieces of opponent
+                self.history[self.position_hash] += 1
+                if stats is not None:
+                    stats.add('capture', clock() - placed)
+                    if self.died_pieces:
+                        stats.count('captured stones', len(self.died_pieces))
             else:
                 #                 print("Move is Passed by :", piece_type)
-                self.previous_board = deepcopy(self.board)
+                self.remember_position()
 
             if verbose:
                 self.visualize_board()  # Visualize the board again
                 # print()
-            player1.board = deepcopy(self.board)
-            player1.previous_board = deepcopy(self.board)
-            player2.board = deepcopy(self.board)
-            player2.previous_board = deepcopy(self.board)
             if piece_type is 1:
                 player1.addState()
             else:
@@ -494,9 +1151,230 @@ class GO:
             self.X_move = not self.X_move  # Players take turn
 
 
-def judge(n_move, verbose=False):
-    """This function is responsible to check if we have a winner after 24 moves"""
-    N = 5
+def dilate_boards(mask):
+    '''
+    Grow boolean masks by one step in the four directions.
+
+    :param mask: boolean array whose last two axes are the board.
+    :return: the masks together with all of their neighbors.
+    '''
+    grown = mask.copy()
+    grown[..., 1:, :] |= mask[..., :-1, :]
+    grown[..., :-1, :] |= mask[..., 1:, :]
+    grown[..., :, 1:] |= mask[..., :, :-1]
+    grown[..., :, :-1] |= mask[..., :, 1:]
+    return grown
+
+
+def flood_boards(seed, within):
+    '''
+    Flood fill every board of a batch at once.
+
+    :param seed: boolean array of starting points, last two axes are the board.
+    :param within: boolean array the fill is restricted to.
+    :return: boolean array of the regions connected to the seeds.
+    '''
+    region = seed & within
+    while True:
+        grown = dilate_boards(region) & within
+        if np.array_equal(grown, region):
+            return region
+        region = grown
+
+
+def label_boards(boards):
+    '''
+    Label the groups of a batch of boards by propagating the smallest point index through each group.
+
+    :param boards: (N, n, n) int8 array.
+    :return: (N, n, n) int32 array with the group label of every stone (-1 on empty points).
+    '''
+    n = boards.shape[-1]
+    stone = boards != 0
+    labels = np.where(stone, np.arange(n * n, dtype=np.int32).reshape(n, n), n * n)
+    # (destination, source) slices for the four directions
+    shifts = [((Ellipsis, slice(1, None), slice(None)), (Ellipsis, slice(None, -1), slice(None))),
+              ((Ellipsis, slice(None, -1), slice(None)), (Ellipsis, slice(1, None), slice(None))),
+              ((Ellipsis, slice(None), slice(1, None)), (Ellipsis, slice(None), slice(None, -1))),
+              ((Ellipsis, slice(None), slice(None, -1)), (Ellipsis, slice(None), slice(1, None)))]
+    connected = [stone[dst] & (boards[dst] == boards[src]) for dst, src in shifts]
+    while True:
+        previous = labels.copy()
+        for (dst, src), same in zip(shifts, connected):
+            labels[dst] = np.where(same, np.minimum(labels[dst], labels[src]), labels[dst])
+        if np.array_equal(labels, previous):
+            return np.where(stone, labels, -1)
+
+
+def neighbor_values(values, fill):
+    '''
+    Gather the up, down, left and right neighbors of every point of a batch of boards.
+
+    :param values: (N, n, n) array.
+    :param fill: value used outside of the board.
+    :return: (N, n, n, 4) array.
+    '''
+    padded = np.pad(values, ((0, 0), (1, 1), (1, 1)), constant_values=fill)
+    return np.stack([padded[:, :-2, 1:-1], padded[:, 2:, 1:-1], padded[:, 1:-1, :-2], padded[:, 1:-1, 2:]], axis=-1)
+
+
+def remove_dead_boards(boards, piece_type):
+    '''
+    Remove the groups of a piece type without liberty from a batch of boards.
+
+    :param boards: int8 array whose last two axes are the board.
+    :param piece_type: piece type per board, broadcastable against boards.
+    :return: (boards without the dead stones, boolean array of the removed stones).
+    '''
+    stones = boards == piece_type
+    alive = flood_boards(stones & dilate_boards(boards == 0), stones)
+    dead = stones & ~alive
+    return np.where(dead, 0, boards).astype(np.int8), dead
+
+
+class BatchGO:
+    def __init__(self, n_games, n):
+        '''
+        N Go games played in lockstep, with all boards held in one (N, n, n) int8 array.
+        Moves are flat point indices i * n + j, and n * n means PASS.
+        Follows the GO rules: KO compares against the previous board, the game ends
+        after max_move moves or two passes in a row, and the winner is judged by stones with komi.
+
+        :param n_games: number of games N.
+        :param n: size of the board n*n
+        '''
+        self.n_games = n_games
+        self.size = n
+        self.max_move = n * n - 1  # The max movement of a Go game
+        self.komi = n / 2  # Komi rule
+        self.pass_move = n * n
+        self.board = np.zeros((n_games, n, n), dtype=np.int8)
+        self.previous_board = np.zeros((n_games, n, n), dtype=np.int8)
+        self.piece_type = np.ones(n_games, dtype=np.int8)  # Player to move, X plays first
+        self.died = np.zeros(n_games, dtype=bool)  # Whether the last move captured stones
+        self.n_move = np.zeros(n_games, dtype=np.int32)
+
+    def reset(self, games=None):
+        '''
+        Start new games.
+
+        :param games: boolean mask of the games to reset, all of them when None.
+        :return: None.
+        '''
+        if games is None:
+            games = np.ones(self.n_games, dtype=bool)
+        self.board[games] = 0
+        self.previous_board[games] = 0
+        self.piece_type[games] = 1
+        self.died[games] = False
+        self.n_move[games] = 0
+
+    def legal_moves(self):
+        '''
+        Find the valid placements of the player to move in every game.
+        Groups are labelled and their liberties counted for all games at once, then a point
+        is valid if it has an empty neighbor, joins a group with another liberty or captures.
+
+        :param: None.
+        :return: (N, n * n + 1) boolean array, the last column (PASS) is always True.
+        '''
+        n_games, n = self.n_games, self.size
+        board = self.board
+        empty = board == 0
+        labels = label_boards(board)
+        # Liberties per group: count each (group, empty point) pair once
+        neighbor_labels = neighbor_values(labels, -1)
+        counted = (neighbor_labels >= 0) & empty[..., None]
+        for d in range(1, 4):
+            counted[..., d] &= ~(neighbor_labels[..., d:d + 1] == neighbor_labels[..., :d]).any(axis=-1)
+        games = np.arange(n_games)[:, None, None, None] * (n * n)
+        libs = np.bincount((games + neighbor_labels)[counted], minlength=n_games * n * n)
+        neighbor_libs = np.where(neighbor_labels >= 0, libs[games + np.maximum(neighbor_labels, 0)], 0)
+
+        neighbor_types = neighbor_values(board, 3)
+        own = self.piece_type[:, None, None, None]
+        liberty = ((neighbor_types == 0) | ((neighbor_types == own) & (neighbor_libs >= 2))).any(axis=-1)
+        captures = (neighbor_types == 3 - own) & (neighbor_libs == 1)
+        capture = captures.any(axis=-1)
+        legal = empty & (liberty | capture)
+
+        # KO rule: a capture without other liberty may not bring back the previous board
+        ko = np.nonzero(empty & capture & ~liberty & self.died[:, None, None])
+        if len(ko[0]):
+            g = ko[0]
+            captured_labels = np.where(captures[ko], neighbor_labels[ko], -2)
+            removed = (labels[g][..., None] == captured_labels[:, None, None, :]).any(axis=-1)
+            after = np.where(removed, 0, board[g])
+            after[np.arange(len(g)), ko[1], ko[2]] = self.piece_type[g]
+            legal[ko] = ~(after == self.previous_board[g]).all(axis=(1, 2))
+        legal = legal.reshape(n_games, n * n)
+        return np.concatenate([legal, np.ones((n_games, 1), dtype=bool)], axis=1)
+
+    def random_actions(self, rng, legal=None):
+        '''
+        Pick a uniformly random valid placement in every game, PASS when there is none.
+
+        :param rng: numpy Generator.
+        :param legal: result of legal_moves, computed when None.
+        :return: (N,) array of moves.
+        '''
+        if legal is None:
+            legal = self.legal_moves()
+        weights = rng.random(legal.shape)
+        weights[:, :-1] += 1  # Prefer any placement over PASS
+        return np.where(legal, weights, -1).argmax(axis=1)
+
+    def score(self, piece_type):
+        return (self.board == piece_type).sum(axis=(1, 2))
+
+    def judge_winner(self):
+        '''
+        Judge the winner of every game by number of pieces for each player.
+
+        :param: None.
+        :return: (N,) array with the piece type of the winner (0 if it's a tie).
+        '''
+        cnt_1 = self.score(1)
+        cnt_2 = self.score(2) + self.komi
+        return np.where(cnt_1 > cnt_2, 1, np.where(cnt_1 < cnt_2, 2, 0)).astype(np.int8)
+
+    def step(self, actions, legal=None):
+        '''
+        Play one move in every game, capturing dead stones, and reset the games that ended.
+
+        :param actions: (N,) array of valid moves, n * n for PASS.
+        :param legal: result of legal_moves for the current boards, computed when None.
+        :return: (N,) int8 array with the winner of each game that ended on this move
+                 (0 for a tie) and -1 for the games still running.
+        '''
+        n_games, n = self.n_games, self.size
+        actions = np.asarray(actions)
+        if legal is None:
+            legal = self.legal_moves()
+        if not legal[np.arange(n_games), actions].all():
+            raise ValueError('BatchGO: invalid placement in step.')
+        moved = actions != self.pass_move
+        repeat_pass = ~moved & (self.previous_board == self.board).all(axis=(1, 2))
+        self.previous_board = self.board.copy()
+
+        rows = np.flatnonzero(moved)
+        placed = self.board.reshape(n_games, n * n).copy()
+        placed[rows, actions[rows]] = self.piece_type[rows]
+        placed = placed.reshape(n_games, n, n)
+        self.board, captured = remove_dead_boards(placed, (3 - self.piece_type)[:, None, None])
+        self.died = captured.any(axis=(1, 2))
+
+        self.n_move += 1
+        self.piece_type = 3 - self.piece_type
+        ended = (self.n_move >= self.max_move) | repeat_pass
+        result = np.where(ended, self.judge_winner(), -1).astype(np.int8)
+        if ended.any():
+            self.reset(ended)
+        return result
+
+
+def judge(n_move, verbose=False, N=BOARD_ROWS):
+    """This function is responsible to check if we have a winner after n*n - 1 moves"""
 
     piece_type, previous_board, board = readInput(N)
     go = GO(N)
@@ -540,81 +1418,582 @@ def judge(n_move, verbose=False):
     sys.exit(0)
 
 
+def encode_position(piece_type, previous_board, board):
+    """One line of the referee protocol: MOVE <piece type> <previous board digits> <board digits>"""
+    return "MOVE {} {} {}\n".format(piece_type, "".join(str(x) for row in previous_board for x in row),
+                                    "".join(str(x) for row in board for x in row))
+
+
+def decode_position(line, n):
+    """Parse a MOVE line into (piece_type, previous_board, board)"""
+    tag, piece_type, previous, current = line.split()
+    previous_board = [[int(x) for x in previous[i * n:(i + 1) * n]] for i in range(n)]
+    board = [[int(x) for x in current[i * n:(i + 1) * n]] for i in range(n)]
+    return int(piece_type), previous_board, board
+
+
+def parse_action(line):
+    """Parse an agent reply "i,j" or "PASS" as output.txt holds it, raises ValueError otherwise"""
+    line = line.strip()
+    if line == "PASS":
+        return "PASS"
+    x, y = line.split(",")
+    return int(x), int(y)
+
+
+class LineAgent:
+    def __init__(self, reader, writer, name):
+        '''
+        Agent speaking the referee line protocol over a pair of text streams.
+        The referee sends "MOVE <piece type> <previous board> <board>" with the boards as n*n digits,
+        the agent answers "i,j" or "PASS", and "END <result>" closes a match. The agent stays up
+        for the next match and quits on "QUIT" or end of file.
+
+        :param reader: stream of the agent replies.
+        :param writer: stream to the agent.
+        :param name: name used in the reports.
+        '''
+        self.reader = reader
+        self.writer = writer
+        self.name = name
+
+    def move(self, piece_type, previous_board, board):
+        self.writer.write(encode_position(piece_type, previous_board, board))
+        self.writer.flush()
+        return parse_action(self.reader.readline())
+
+    def end(self, result):
+        self.writer.write("END {}\n".format(result))
+        self.writer.flush()
+
+    def close(self):
+        try:
+            self.writer.write("QUIT\n")
+            self.writer.flush()
+        except (OSError, ValueError):
+            pass
+
+
+class PipeAgent(LineAgent):
+    def __init__(self, command):
+        '''
+        Agent process started once and spoken to over its stdin and stdout.
+
+        :param command: command line of the agent.
+        '''
+        self.process = subprocess.Popen(shlex.split(command), stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        universal_newlines=True, bufsize=1)
+        LineAgent.__init__(self, self.process.stdout, self.process.stdin, command)
+
+    def close(self):
+        LineAgent.close(self)
+        self.process.stdin.close()
+        self.process.wait()
+
+
+class SocketAgent(LineAgent):
+    def __init__(self, host, port, timeout=None):
+        '''
+        Agent listening on a local socket, see serve_agent.
+
+        :param host: host name.
+        :param port: port number.
+        :param timeout: seconds to wait for a reply, None waits forever.
+        '''
+        self.connection = socket.create_connection((host, port), timeout=timeout)
+        stream = self.connection.makefile("rw")
+        LineAgent.__init__(self, stream, stream, "{}:{}".format(host, port))
+
+    def close(self):
+        LineAgent.close(self)
+        self.connection.close()
+
+
+class FileAgent:
+    def __init__(self, command, directory="."):
+        '''
+        Compatibility agent for programs reading input.txt and writing output.txt: the command
+        is run in directory once per move.
+
+        :param command: command line of the agent.
+        :param directory: directory holding input.txt and output.txt.
+        '''
+        self.command = shlex.split(command)
+        self.directory = directory
+        self.name = command
+
+    def move(self, piece_type, previous_board, board):
+        input_path = os.path.join(self.directory, "input.txt")
+        output_path = os.path.join(self.directory, "output.txt")
+        writeNextInput(piece_type, previous_board, board, path=input_path)
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        subprocess.run(self.command, cwd=self.directory)
+        action, x, y = readOutput(output_path)
+        return "PASS" if action == "PASS" else (x, y)
+
+    def end(self, result):
+        pass
+
+    def close(self):
+        pass
+
+
+class PlayerAgent:
+    def __init__(self, player):
+        '''
+        In-process agent playing a Player instance, with no protocol at all.
+
+        :param player: Player instance, it plays whichever piece type it is asked to move.
+        '''
+        self.player = player
+        self.player.verbose = False
+        self.player.exp_rate = 0
+        self.name = player.name
+
+    def move(self, piece_type, previous_board, board):
+        player = self.player
+        player.playerSymbol = piece_type
+        player.reset()
+        player.go.set_board(piece_type, previous_board, board)
+        return player.get_input()
+
+    def end(self, result):
+        pass
+
+    def close(self):
+        pass
+
+
+def connect_agent(spec, size=BOARD_ROWS):
+    '''
+    Open an agent from a command line spec:
+    "tcp:HOST:PORT" for serve_agent on a socket, "file:DIR:COMMAND" for an input.txt/output.txt program,
+    "policy:PATH" for a Player loading a policy in this process, anything else is run as a pipe agent.
+
+    :param spec: agent spec.
+    :param size: size of the board, for the policy agents.
+    :return: agent instance.
+    '''
+    if spec.startswith("tcp:"):
+        host, port = spec[4:].rsplit(":", 1)
+        return SocketAgent(host, int(port))
+    if spec.startswith("file:"):
+        directory, command = spec[5:].split(":", 1)
+        return FileAgent(command, directory)
+    if spec.startswith("policy:"):
+        player = Player(name=spec[7:], typ="computer", symbol=1, size=size)
+        player.loadPolicy(spec[7:], mmap=True)
+        return PlayerAgent(player)
+    return PipeAgent(spec)
+
+
+class Referee:
+    def __init__(self, n=5, verbose=False):
+        '''
+        Long-lived referee keeping one GO instance and applying the rules of judge() move by move,
+        without a process or file round trip per move.
+
+        :param n: size of the board n*n
+        :param verbose: print the boards and results.
+        '''
+        self.go = GO(n)
+        self.verbose = verbose
+
+    def play_match(self, black, white):
+        '''
+        Play one game. As in judge(), an invalid move or reply loses the game.
+
+        :param black: agent playing 'X', it has a move(piece_type, previous_board, board) method.
+        :param white: agent playing 'O'.
+        :return: piece type of the winner (0 if it's a tie).
+        '''
+        go = self.go
+        go.init_board(go.size)
+        go.verbose = self.verbose
+        agents = [None, black, white]
+        piece_type = 1
+        while True:
+            try:
+                action = agents[piece_type].move(piece_type, go.previous_board, go.board)
+            except (ValueError, OSError) as e:
+                if self.verbose:
+                    print("{} sent an invalid reply: {}".format(agents[piece_type].name, e))
+                result = 3 - piece_type
+                break
+            go.n_move += 1
+            if action != "PASS":
+                if not go.place_chess(action[0], action[1], piece_type):
+                    if self.verbose:
+                        print('Game end.')
+                        print('The winner is {}'.format('X' if 3 - piece_type == 1 else 'O'))
+                    result = 3 - piece_type
+                    break
+                go.died_pieces = go.remove_died_pieces(3 - piece_type)
+                go.history[go.position_hash] += 1
+            if self.verbose:
+                go.visualize_board()
+                print()
+            if go.game_end(piece_type, "PASS" if action == "PASS" else "MOVE"):
+                result = go.judge_winner()
+                if self.verbose:
+                    print('Game end.')
+                    if result == 0:
+                        print('The game is a tie.')
+                    else:
+                        print('The winner is {}'.format('X' if result == 1 else 'O'))
+                break
+            if action == "PASS":
+                go.remember_position()
+            piece_type = 3 - piece_type
+        for agent in (black, white):
+            try:
+                agent.end(result)
+            except (OSError, ValueError):
+                pass
+        return result
+
+    def play_matches(self, agent1, agent2, matches):
+        '''
+        Play a series of games, the agents swapping colors after each game.
+
+        :param agent1: first agent.
+        :param agent2: second agent.
+        :param matches: number of games.
+        :return: [ties, wins of agent1, wins of agent2].
+        '''
+        tally = [0, 0, 0]
+        for k in range(matches):
+            if k % 2 == 0:
+                result = self.play_match(agent1, agent2)
+                tally[result] += 1
+            else:
+                result = self.play_match(agent2, agent1)
+                tally[(3 - result) % 3] += 1
+        return tally
+
+
+def serve_agent(player, reader=sys.stdin, writer=sys.stdout):
+    '''
+    Answer referee MOVE lines with the moves of a player until QUIT or end of file.
+
+    :param player: Player instance.
+    :param reader: stream of the referee lines.
+    :param writer: stream for the replies.
+    :return: None.
+    '''
+    agent = PlayerAgent(player)
+    n = player.size
+    for line in reader:
+        if line.startswith("QUIT"):
+            break
+        if not line.startswith("MOVE"):
+            continue
+        # Keep the player's messages out of the replies
+        with contextlib.redirect_stdout(sys.stderr):
+            action = agent.move(*decode_position(line, n))
+        writer.write(format_action(action))
+        writer.flush()
+
+
+def format_action(action):
+    """Reply line of the referee protocol for a move"""
+    return "PASS\n" if action == "PASS" else "{},{}\n".format(action[0], action[1])
+
+
+class MoveServer:
+    def __init__(self, player, cache_size=100000, batch_size=256, batch_window=0.0005):
+        '''
+        asyncio server answering the referee line protocol of serve_agent for many games at once.
+        A connection may send MOVE lines without waiting for the replies, which come back in order.
+        Moves are taken from an LRU cache of position -> move. The other positions wait up to
+        batch_window for more requests, and the whole batch shares one value lookup.
+
+        :param player: Player instance with the policy, it plays whichever piece type it is asked to move.
+        :param cache_size: positions kept in the move cache, 0 for no cache.
+        :param batch_size: most positions evaluated together.
+        :param batch_window: seconds a position waits for others to share its evaluation.
+        '''
+        self.player = player
+        self.player.verbose = False
+        self.player.exp_rate = 0
+        self.cache = OrderedDict()  # position -> move, least recently used first
+        self.cache_size = cache_size
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.waiting = {}  # position -> future of its move, shared by identical requests
+        self.queue = None  # asyncio.Queue of positions to evaluate, made in the server's event loop
+        self.hits = 0
+        self.evaluated = 0
+        self.batches = 0
+
+    async def serve(self, host, port):
+        self.queue = asyncio.Queue()
+        batches = asyncio.ensure_future(self.run_batches())
+        server = await asyncio.start_server(self.handle, host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batches.cancel()
+
+    async def handle(self, reader, writer):
+        replies = asyncio.Queue(maxsize=1024)  # Moves in request order, bounded so a client cannot queue forever
+        sender = asyncio.ensure_future(self.send_replies(replies, writer))
+        try:
+            while True:
+                line = await reader.readline()
+                if not line or line.startswith(b"QUIT"):
+                    break
+                if line.startswith(b"MOVE"):
+                    await replies.put(asyncio.ensure_future(self.move(line.decode())))
+        finally:
+            await replies.put(None)
+            await sender
+            writer.close()
+
+    async def send_replies(self, replies, writer):
+        # Takes the replies until the None put by handle, even once the connection is closed,
+        # so handle never waits forever on a full queue
+        closed = False
+        while True:
+            reply = await replies.get()
+            if reply is None:
+                return
+            if closed:
+                continue
+            try:
+                action = await reply
+                writer.write(format_action(action).encode())
+                await writer.drain()
+            except ValueError as error:
+                # Not a valid MOVE line, the client does not follow the protocol
+                print("Closing a connection: {}".format(error), file=sys.stderr)
+                writer.close()
+                closed = True
+            except ConnectionError:
+                closed = True
+
+    async def move(self, line):
+        '''
+        Get the move of a position, from the cache or from the next batch.
+
+        :param line: MOVE line.
+        :return: (i, j) or "PASS".
+        '''
+        key = line.strip()
+        cache = self.cache
+        if key in cache:
+            cache.move_to_end(key)
+            self.hits += 1
+            return cache[key]
+        future = self.waiting.get(key)
+        if future is None:
+            tag, piece_type, previous, current = key.split()
+            if piece_type not in ("1", "2"):
+                raise ValueError("Not a piece type: {}".format(piece_type))
+            tables = self.player.go.tables
+            position = (int(piece_type), tables.from_digits(previous), tables.from_digits(current))
+            future = self.waiting[key] = asyncio.get_running_loop().create_future()
+            self.queue.put_nowait((key, position, future))
+        return await future
+
+    async def run_batches(self):
+        while True:
+            batch = [await self.queue.get()]
+            # Give the other connections a chance to send their positions
+            await asyncio.sleep(self.batch_window)
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            try:
+                moves = self.choose_moves([position for key, position, future in batch])
+            except Exception as error:
+                for key, position, future in batch:
+                    del self.waiting[key]
+                    future.set_exception(error)
+                continue
+            self.batches += 1
+            self.evaluated += len(batch)
+            cache = self.cache
+            for (key, position, future), action in zip(batch, moves):
+                del self.waiting[key]
+                if self.cache_size:
+                    cache[key] = action
+                    if len(cache) > self.cache_size:
+                        cache.popitem(last=False)
+                future.set_result(action)
+
+    def choose_moves(self, positions):
+        '''
+        Choose the greedy moves of many positions, looking up the values after all their moves at once.
+
+        :param positions: list of (piece_type, previous stone masks, stone masks).
+        :return: list of (i, j) or "PASS".
+        '''
+        player = self.player
+        go = player.go
+        candidates = []
+        keys = []
+        for piece_type, previous_stones, stones in positions:
+            player.playerSymbol = piece_type
+            go.set_stones(piece_type, previous_stones, stones)
+            actions = player.legalActions()
+            candidates.append(actions)
+            if actions:
+                keys.append(go.afterstate_keys(actions, piece_type))
+        if not keys:
+            return ["PASS"] * len(positions)
+        values = player.states_value.get_many(np.concatenate(keys), 0)
+        moves = []
+        start = 0
+        for actions in candidates:
+            if not actions:
+                moves.append("PASS")
+                continue
+            moves.append(player.bestAction(actions, values[start:start + len(actions)]))
+            start += len(actions)
+        return moves
+
+
 class Player:
-    def __init__(self, name, typ, symbol, exp_rate=0.59):
+    def __init__(self, name, typ, symbol, exp_rate=0.59, seed=None, size=BOARD_ROWS):
         self.name = name
-        self.size = 5
-        self.previous_board = [[0 for x in range(BOARD_ROWS)] for y in range(BOARD_COLS)]  # Empty space marked as 0
-        self.board = [[0 for x in range(BOARD_ROWS)] for y in range(BOARD_COLS)]  # Empty space marked as 0
+        self.size = size
+        self.own_go = GO(self.size)  # Rules engine holding the player's own board
+        self.go = self.own_go  # Board the player reads, the one of the game being played during GO.play
         self.type = typ
-        self.died_pieces = []
         self.states = []  # record all positions taken
         self.lr = 0.7
         self.playerSymbol = symbol
         self.exp_rate = exp_rate
         self.decay_gamma = 0.9
         self.verbose = True  # Verbose only when there is a manual player
-        self.states_value = {}  # state -> value
+        self.states_value = ValueTable()  # state -> value
+        self.rng = random.Random(seed)  # exploration and tie-breaking
+        self.stats = None  # Instrumentation timing the move choice, None when off
+        self.replay = None  # ReplayBuffer keeping the rewarded games, None when off
+
+    @property
+    def board(self):
+        return self.go.board
 
-    # def __de
+    @board.setter
+    def board(self, board):
+        self.go.board = board
+
+    @property
+    def previous_board(self):
+        return self.go.previous_board
+
+    @previous_board.setter
+    def previous_board(self, board):
+        self.go.previous_board = board
+
+    @property
+    def died_pieces(self):
+        return self.go.died_pieces
+
+    @died_pieces.setter
+    def died_pieces(self, died_pieces):
+        self.go.died_pieces = died_pieces
+
+    def watch(self, go):
+        '''
+        Follow the board of a game instead of the player's own, the game updates it and the player
+        only reads it to choose its moves and record its states. reset goes back to the own board.
+
+        :param go: GO instance of the game.
+        :return: None.
+        '''
+        self.go = go
 
     def reset(self):
-        self.previous_board = [[0 for x in range(BOARD_ROWS)] for y in range(BOARD_COLS)]  # Empty space marked as 0
-        self.board = [[0 for x in range(BOARD_ROWS)] for y in range(BOARD_COLS)]  # Empty space marked as 0
+        self.go = self.own_go
+        self.go.init_board(self.size)  # Empty space marked as 0
         self.died_pieces = []
         self.states = []  # record all positions taken
 
-    def getHash(self, board):
-        hash_board = ""
-        for i in board:
-            for j in i:
-                hash_board += str(j)
-        return hash_board
+    def getHash(self, board=None):
+        # Zobrist key of the position after our move, so with the opponent to move.
+        # Symmetric positions (rotations, reflections, color swaps) share their key.
+        if board is None:
+            return self.go.canonical_key(3 - self.playerSymbol)
+        tables = self.go.tables
+        return tables.canonical_key(tables.hash_symmetries(tables.from_board(board)), 3 - self.playerSymbol)
 
     def feedReward(self, reward):
         """THis function is responsible to reward the gameplaying agents after a win/loss"""
+        if self.replay is not None:
+            self.replay.add(self.states, reward)
         for st in reversed(self.states):
-            if self.states_value.get(st) is None:
-                self.states_value[st] = 0
-            self.states_value[st] += self.lr * (self.decay_gamma * reward - self.states_value[st])
-            reward = self.states_value[st]
+            reward = self.states_value.update(st, self.decay_gamma * reward, self.lr)
+
+    def replayGames(self, count=None):
+        '''
+        Learn again from games stored in the replay buffer, as feedReward did when they ended.
+        The largest value change of each game becomes its priority.
+
+        :param count: number of games, the buffer's batch_size by default.
+        :return: number of games replayed.
+        '''
+        replay = self.replay
+        slots = replay.sample(count)
+        values = self.states_value
+        priorities = []
+        for slot in slots.tolist():
+            states, reward = replay.episode(slot)
+            change = 0.0
+            for st in reversed(states.tolist()):
+                value = values.get(st, 0.0)
+                reward = values.update(st, self.decay_gamma * reward, self.lr)
+                change = max(change, abs(reward - value))
+            priorities.append(change)
+        replay.update_priorities(slots, priorities)
+        return len(slots)
 
     def chooseAction(self, positions):
-        if random.uniform(0, 1) <= self.exp_rate:
+        if self.rng.uniform(0, 1) <= self.exp_rate:
             # take random action
-            action = random.choice(positions)
+            action = self.rng.choice(positions)
             return action
         else:
-            value_max = -999
-            for p in positions:
-                next_board = deepcopy(self.board)
-                next_board[p[0]][p[1]] = self.playerSymbol
-                next_boardHash = self.getHash(next_board)
-                value = 0 if self.states_value.get(next_boardHash) is None else self.states_value.get(next_boardHash)
-                # print("value", value)
-                if value >= value_max:
-                    value_max = value
-                    action = p
+            # Value of the position after each move, looked up all at once
+            values = self.states_value.get_many(self.go.afterstate_keys(positions, self.playerSymbol), 0)
+            action = self.bestAction(positions, values)
         # print("{} takes action {}".format(self.name, action))
         return action
 
-    def get_input(self):
-        positions = self.availablePositions()
-        if len(positions) is 0:
+    def bestAction(self, positions, values):
+        # One of the moves leading to the highest value, ties broken at random
+        best = np.flatnonzero(values == values.max())
+        return positions[best[self.rng.randrange(len(best))]]
+
+    def legalActions(self):
+        go = self.go
+        available = self.availableMask()
+        if not available:
             print("Zero Positions Returned!")
-        actions = []
-        for position in positions:
-            if self.valid_place_check(position[0], position[1], self.playerSymbol):
-                actions.append(position)
+        return go.tables.to_coords(available & go.legal_moves(self.playerSymbol))
+
+    def get_input(self):
+        stats = self.stats
+        if stats is not None:
+            start = clock()
+        actions = self.legalActions()
+        if stats is not None:
+            generated = clock()
+            stats.add('legal_moves', generated - start)
 
         if len(actions) is 0:
             # print("No Actions to make! Return PAss")
             return "PASS"
         action = self.chooseAction(positions=actions)
+        if stats is not None:
+            stats.add('select', clock() - generated)
         return action
 
     def addState(self):
-        self.states.append(self.getHash(self.board))
+        self.states.append(self.getHash())
 
     def copy_board(self):
         '''
@@ -632,7 +2011,7 @@ class Player:
         :param new_board: new board.
         :return: None.
         '''
-        self.board = new_board
+        self.go.update_board(new_board)
 
     def detect_neighbor(self, i, j):
         '''
@@ -642,14 +2021,7 @@ class Player:
         :param j: column number of the board.
         :return: a list containing the neighbors row and column (row, column) of position (i, j).
         '''
-        board = self.board
-        neighbors = []
-        # Detect borders and add neighbor coordinates
-        if i > 0: neighbors.append((i - 1, j))
-        if i < len(board) - 1: neighbors.append((i + 1, j))
-        if j > 0: neighbors.append((i, j - 1))
-        if j < len(board) - 1: neighbors.append((i, j + 1))
-        return neighbors
+        return self.go.detect_neighbor(i, j)
 
     def detect_neighbor_ally(self, i, j):
         '''
@@ -659,34 +2031,17 @@ class Player:
         :param j: column number of the board.
         :return: a list containing the neighbored allies row and column (row, column) of position (i, j).
         '''
-        board = self.board
-        neighbors = self.detect_neighbor(i, j)  # Detect neighbors
-        group_allies = []
-        # Iterate through neighbors
-        for piece in neighbors:
-            # Add to allies list if having the same color
-            if board[piece[0]][piece[1]] == board[i][j]:
-                group_allies.append(piece)
-        return group_allies
+        return self.go.detect_neighbor_ally(i, j)
 
     def ally_dfs(self, i, j):
         '''
-        Using DFS to search for all allies of a given stone.
+        Search for all allies of a given stone.
 
         :param i: row number of the board.
         :param j: column number of the board.
         :return: a list containing the all allies row and column (row, column) of position (i, j).
         '''
-        stack = [(i, j)]  # stack for DFS serach
-        ally_members = []  # record allies positions during the search
-        while stack:
-            piece = stack.pop()
-            ally_members.append(piece)
-            neighbor_allies = self.detect_neighbor_ally(piece[0], piece[1])
-            for ally in neighbor_allies:
-                if ally not in stack and ally not in ally_members:
-                    stack.append(ally)
-        return ally_members
+        return self.go.ally_dfs(i, j)
 
     def find_liberty(self, i, j):
         '''
@@ -696,23 +2051,10 @@ class Player:
         :param j: column number of the board.
         :return: boolean indicating whether the given stone still has liberty.
         '''
-        board = self.board
-        ally_members = self.ally_dfs(i, j)
-        for member in ally_members:
-            neighbors = self.detect_neighbor(member[0], member[1])
-            for piece in neighbors:
-                # If there is empty space around a piece, it has liberty
-                if board[piece[0]][piece[1]] == 0:
-                    return True
-        # If none of the pieces in a allied group has an empty space, it has no liberty
-        return False
+        return self.go.find_liberty(i, j)
 
     def compare_board(self, board1, board2):
-        for i in range(self.size):
-            for j in range(self.size):
-                if board1[i][j] != board2[i][j]:
-                    return False
-        return True
+        return self.go.compare_board(board1, board2)
 
     def find_died_pieces(self, piece_type):
         '''
@@ -721,17 +2063,7 @@ class Player:
         :param piece_type: 1('X') or 2('O').
         :return: a list containing the dead pieces row and column(row, column).
         '''
-        board = self.board
-        died_pieces = []
-
-        for i in range(len(board)):
-            for j in range(len(board)):
-                # Check if there is a piece at this position:
-                if board[i][j] == piece_type:
-                    # The piece die if it has no liberty
-                    if not self.find_liberty(i, j):
-                        died_pieces.append((i, j))
-        return died_pieces
+        return self.go.find_died_pieces(piece_type)
 
     def remove_died_pieces(self, piece_type):
         '''
@@ -740,11 +2072,7 @@ class Player:
         :param piece_type: 1('X') or 2('O').
         :return: locations of dead pieces.
         '''
-
-        died_pieces = self.find_died_pieces(piece_type)
-        if not died_pieces: return []
-        self.remove_certain_pieces(died_pieces)
-        return died_pieces
+        return self.go.remove_died_pieces(piece_type)
 
     def remove_certain_pieces(self, positions):
         '''
@@ -753,10 +2081,7 @@ class Player:
         :param positions: a list containing the pieces to be removed row and column(row, column)
         :return: None.
         '''
-        board = self.board
-        for piece in positions:
-            board[piece[0]][piece[1]] = 0
-        self.update_board(board)
+        self.go.remove_certain_pieces(positions)
 
     def valid_place_check(self, i, j, piece_type, test_check=False):
         '''
@@ -768,102 +2093,460 @@ class Player:
         :param test_check: boolean if it's a test check.
         :return: boolean indicating whether the placement is valid.
         '''
-        board = self.board
-        verbose = self.verbose
-        if test_check:
-            verbose = False
-
-        # Copy the board for testing
-
-        test_go = Player(name=self.name, typ=self.type, symbol=self.playerSymbol)
-        test_go.board = deepcopy(self.board)
-        test_board = test_go.board
-
-        # Check if the place has liberty
-        test_board[i][j] = piece_type
-        test_go.update_board(test_board)
-        if test_go.find_liberty(i, j):
-            return True
+        # The board may be the game's own, its verbose flag is left alone
+        return self.go.valid_place_check(i, j, piece_type, test_check, verbose=self.verbose)
 
-        # If not, remove the died pieces of opponent and check again
-        test_go.remove_died_pieces(3 - piece_type)
-        if not test_go.find_liberty(i, j):
-            if verbose:
-                print('Invalid placement. No liberty found in this position.')
-            return False
-
-        # Check special case: repeat placement causing the repeat board state (KO rule)
-        else:
-            if self.died_pieces and self.compare_board(self.previous_board, test_go.board):
-                if verbose:
-                    print('Invalid placement. A repeat move not permitted by the KO rule.')
-                return False
-        return True
+    def availableMask(self):
+        # Empty points, except those whose neighbors are all opponent stones
+        go = self.go
+        tables = go.tables
+        empty = tables.full & ~(go.stones[1] | go.stones[2])
+        return empty & tables.neighbors(tables.full & ~go.stones[1 if self.playerSymbol == 2 else 2])
 
     def availablePositions(self):
-        positions = []
-        bit = True
-        target = 1 if self.playerSymbol == 2 else 2
-        for i in range(BOARD_ROWS):
-            for j in range(BOARD_COLS):
-                if self.board[i][j] == 0:
-                    if 0 < i < BOARD_ROWS - 1 and 0 < j < BOARD_COLS - 1:
-                        if self.board[i - 1][j] == target and self.board[i + 1][j] == target and self.board[
-                            i][j + 1] == target and self.board[i][j - 1] == target:
-                            bit = False
-                    elif j == 0 and i == 0:
-                        if self.board[i][j + 1] == target and self.board[i + 1][j] == target:
-                            bit = False
-                    elif i == 0 and 0 < j < BOARD_COLS - 1:
-                        if self.board[i][j - 1] == target and self.board[i][j + 1] == target and self.board[
-                            i + 1][j] == target:
-                            bit = False
-                    elif i == 0 and j == BOARD_COLS - 1:
-                        if self.board[i][j - 1] == target and self.board[i + 1][j] == target:
-                            bit = False
-                    elif j == BOARD_COLS - 1 and 0 < i < BOARD_ROWS - 1:
-                        if self.board[i - 1][j] == target and self.board[i][j - 1] == target and self.board[
-                            i + 1][j] == target:
-                            bit = False
-                    elif i == BOARD_ROWS - 1 and j == BOARD_COLS - 1:
-                        if self.board[i - 1][j] == target and self.board[i][j - 1] == target:
-                            bit = False
-                    elif i == BOARD_ROWS - 1 and 0 < j < BOARD_COLS - 1:
-                        if self.board[i][j - 1] == target and self.board[i][j + 1] == target and self.board[
-                            i - 1][j] == target:
-                            bit = False
-                    elif i == BOARD_ROWS - 1 and j == 0:
-                        if self.board[i][j + 1] == target and self.board[i - 1][j] == target:
-                            bit = False
-                    elif j == 0 and 0 < i < BOARD_ROWS - 1:
-                        if self.board[i - 1][j] == target and self.board[i + 1][j] == target and self.board[
-                            i][j + 1] == target:
-                            bit = False
-                    if bit:
-                        positions.append((i, j))  # need to be tuple
-                    bit = True
+        positions = self.go.tables.to_coords(self.availableMask())  # need to be tuple
         if len(positions) is 0:
             print("Zero Positions Returned!")
         return positions
 
     def savePolicy(self, i):
-        fw = open(str(i) + 'run_policy_' + str(self.name), 'wb')
-        pickle.dump(self.states_value, fw)
-        fw.close()
-
-    def loadPolicy(self, file):
-        fr = open(file, 'rb')
-        self.states_value = pickle.load(fr)
-        fr.close()
+        save_policy(str(i) + 'run_policy_' + str(self.name), self.states_value)
+
+    def loadPolicy(self, file, mmap=False):
+        # mmap opens the policy read-only, for playing without training
+        self.states_value = load_policy(file, mmap=mmap, key_fn=self.legacyHash)
+
+    def legacyHash(self, hash_board):
+        # Policies pickled by older versions keyed the board by its digits
+        n = self.size
+        board = [[int(x) for x in hash_board[i * n:(i + 1) * n]] for i in range(n)]
+        return self.getHash(board)
+
+
+REWARDS = {0: (0.5, 0.1), 1: (1, 0), 2: (0, 1)}  # result of a game -> (reward of player 1, reward of player 2)
+
+
+def reward_players(player1, player2, result):
+    """Backpropagate the result of a game to both players, as REWARDS gives them"""
+    reward1, reward2 = REWARDS[result]
+    player1.feedReward(reward1)
+    player2.feedReward(reward2)
+
+
+def reward_games(player1, player2, games, deterministic=False):
+    """
+    reward_players for many games at once, with the batched backup of the value tables.
+
+    :param player1: Player instance learning the 'X' side.
+    :param player2: Player instance learning the 'O' side.
+    :param games: list of (states of player 1, states of player 2, result).
+    :param deterministic: give exactly the values of reward_players called game after game.
+    :return: None.
+    """
+    for index, player in enumerate((player1, player2)):
+        trajectories = [game[index] for game in games]
+        rewards = [REWARDS[game[2]][index] for game in games]
+        if player.replay is not None:
+            for states, reward in zip(trajectories, rewards):
+                player.replay.add(states, reward)
+        lengths = np.array([len(states) for states in trajectories])
+        states = np.zeros((len(games), lengths.max(initial=0)), dtype=np.uint64)
+        for row, trajectory in enumerate(trajectories):
+            states[row, :len(trajectory)] = trajectory
+        backup_episodes(player.states_value, states, lengths, rewards, player.lr, player.decay_gamma,
+                        deterministic=deterministic)
+
+
+def training_state(games, player1, player2):
+    """What a checkpoint needs besides the value tables to resume training after games games"""
+    return {"games": games, "exp_rate": (player1.exp_rate, player2.exp_rate),
+            "rng": (player1.rng.getstate(), player2.rng.getstate(), random.getstate())}
+
+
+def restore_training_state(state, tables, player1, player2):
+    """Give the players the tables and training state of a checkpoint, returning the number of games played"""
+    player1.states_value = tables[player1.name]
+    player2.states_value = tables[player2.name]
+    player1.exp_rate, player2.exp_rate = state["exp_rate"]
+    rng1, rng2, rng = state["rng"]
+    player1.rng.setstate(rng1)
+    player2.rng.setstate(rng2)
+    random.setstate(rng)
+    return state["games"]
+
+
+def training_schedule(i, player1, player2, save_policy_after, learning_rate_decay, stats=None, checkpoint=None):
+    """
+    Replay stored games, save the policies and decay the exploration rate once game i has been learned.
+    With a Checkpointer, the policies are checkpointed in the background instead of saved in full.
+    """
+    for player in (player1, player2):
+        if player.replay is not None:
+            if stats is not None:
+                start = clock()
+            replayed = player.replayGames()
+            if stats is not None:
+                stats.add('replay', clock() - start, replayed)
+    if i % save_policy_after == 0:
+        print("Rounds {}".format(i))
+        if checkpoint is None:
+            if stats is not None:
+                start = clock()
+            player1.savePolicy(i + save_policy_after)
+            player2.savePolicy(i + save_policy_after)
+            if stats is not None:
+                stats.add('checkpoint', clock() - start)
+    if i % learning_rate_decay == 0:
+        player1.exp_rate = player1.exp_rate * 0.9
+        player2.exp_rate = player2.exp_rate * 0.9
+        print("Current Exp Rate:-", player1.exp_rate)
+    if checkpoint is not None and i % save_policy_after == 0:
+        if stats is not None:
+            start = clock()
+        checkpoint.save({player1.name: player1.states_value, player2.name: player2.states_value},
+                        training_state(i + 1, player1, player2))
+        if stats is not None:
+            stats.add('checkpoint', clock() - start)
+
+
+def self_play_worker(n_games, inbox, episodes, chunk_size=100, seed=None, size=BOARD_ROWS, area_scoring=False):
+    """
+    Play self-play games with frozen copies of the value tables and send what was visited to the learner.
+
+    :param n_games: number of games to play.
+    :param inbox: queue of pickled (states_value of player 1, states_value of player 2, exp_rate of player 1,
+                  exp_rate of player 2) snapshots.
+    :param episodes: queue receiving lists of (states of player 1, states of player 2, result), then None.
+    :param chunk_size: number of games sent together.
+    :param seed: seed of the worker's random generator.
+    :param size: size of the board.
+    :param area_scoring: judge the games by area instead of stones.
+    """
+    rng = random.Random(seed)
+    go = GO(size)
+    go.area_scoring = area_scoring
+    # Not 'manual', so GO.play neither prints the boards nor feeds the rewards
+    player1 = Player(name="player1", typ="worker", symbol=1, seed=rng.getrandbits(32), size=size)
+    player2 = Player(name="player2", typ="worker", symbol=2, seed=rng.getrandbits(32), size=size)
+    player1.verbose = player2.verbose = False
+    snapshot = inbox.get()
+    chunk = []
+    for i in range(n_games):
+        # Switch to the latest tables sent by the learner, only unpickled when there are new ones
+        try:
+            while True:
+                snapshot = inbox.get_nowait()
+        except queue.Empty:
+            pass
+        if snapshot is not None:
+            player1.states_value, player2.states_value, player1.exp_rate, player2.exp_rate = pickle.loads(snapshot)
+            snapshot = None
+        result = go.play(player1=player1, player2=player2)
+        chunk.append((player1.states, player2.states, result))
+        player1.reset()
+        player2.reset()
+        if len(chunk) == chunk_size:
+            episodes.put(chunk)
+            chunk = []
+    if chunk:
+        episodes.put(chunk)
+    episodes.put(None)
+
+
+def train_parallel(player1, player2, num_games, workers, save_policy_after, learning_rate_decay, sync_after=10000,
+                   stats=None, area_scoring=False, backup="serial", first_game=0, checkpoint=None):
+    """
+    Self-play on a pool of worker processes while this process learns.
+    Workers play with snapshots of the value tables and stream the visited states back,
+    the rewards are fed here and fresh snapshots are sent every sync_after games.
+    The batched backups learn a whole chunk of games before its saves and snapshots are made.
+
+    :param player1: Player instance learning the 'X' side.
+    :param player2: Player instance learning the 'O' side.
+    :param num_games: total number of games.
+    :param workers: number of worker processes.
+    :param save_policy_after: games between two policy saves.
+    :param learning_rate_decay: games between two exploration rate decays.
+    :param sync_after: games between two snapshots sent to the workers.
+    :param stats: Instrumentation of the learner, or None.
+    :param area_scoring: judge the games by area instead of stones.
+    :param backup: "serial" feeds the rewards game by game, "batch" backs up each chunk of games at once,
+                   "exact" too with the same values as "serial".
+    :param first_game: number of games already played by a resumed training.
+    :param checkpoint: Checkpointer replacing the policy saves, or None.
+    :return: None.
+    """
+    episodes = multiprocessing.Queue(maxsize=4 * workers)
+    inboxes = [multiprocessing.Queue() for w in range(workers)]
+    processes = []
+    for w in range(workers):
+        n_games = (num_games - first_game) // workers + (1 if w < (num_games - first_game) % workers else 0)
+        seed = random.getrandbits(32)
+        processes.append(multiprocessing.Process(target=self_play_worker, args=(n_games, inboxes[w], episodes),
+                                                 kwargs={"seed": seed, "size": player1.size,
+                                                         "area_scoring": area_scoring}, daemon=True))
+    for process in processes:
+        process.start()
+
+    def sync():
+        if stats is not None:
+            start = clock()
+        # Pickled here, once for all the workers: the queues pickle later in a feeder thread,
+        # while the tables keep changing
+        snapshot = pickle.dumps((player1.states_value, player2.states_value, player1.exp_rate, player2.exp_rate),
+                                protocol=pickle.HIGHEST_PROTOCOL)
+        for inbox in inboxes:
+            inbox.put(snapshot)
+        if stats is not None:
+            stats.add('sync', clock() - start)
+
+    sync()
+    i = first_game
+    running = workers
+    while running:
+        chunk = episodes.get()
+        if chunk is None:
+            running -= 1
+            continue
+        if backup != "serial":
+            if stats is not None:
+                start = clock()
+            reward_games(player1, player2, chunk, deterministic=backup == "exact")
+            if stats is not None:
+                stats.add('reward', clock() - start, len(chunk))
+        for states1, states2, result in chunk:
+            if backup == "serial":
+                player1.states = states1
+                player2.states = states2
+                if stats is not None:
+                    start = clock()
+                reward_players(player1, player2, result)
+                if stats is not None:
+                    stats.add('reward', clock() - start)
+            if stats is not None:
+                stats.end_game(len(states1) + len(states2))
+            player1.reset()
+            player2.reset()
+            training_schedule(i, player1, player2, save_policy_after, learning_rate_decay, stats, checkpoint)
+            i += 1
+            if i % sync_after == 0:
+                sync()
+    for process in processes:
+        process.join()
+    for inbox in inboxes:
+        # Snapshots sent after a worker finished are never read, do not wait to flush them
+        inbox.cancel_join_thread()
+
+
+tournament_players = {}  # policy index -> Player, loaded once per tournament worker
+
+
+def tournament_worker_init(paths, size=BOARD_ROWS):
+    """Load every policy of the tournament once, read-only with mmap so the workers share the pages"""
+    for index, path in enumerate(paths):
+        player = Player(name=path, typ="computer", symbol=1, size=size)
+        player.loadPolicy(path, mmap=True)
+        tournament_players[index] = player
+
+
+def tournament_match(task):
+    """
+    Play games between two policies of the tournament, colors alternating.
+
+    :param task: (index of policy a, index of policy b, number of games, seed).
+    :return: (a, b, wins of a, wins of b, draws).
+    """
+    a, b, n_games, seed = task
+    rng = random.Random(seed)
+    agents = {}
+    for index in (a, b):
+        agents[index] = PlayerAgent(tournament_players[index])
+        # Ties between equal values are broken at random, reproducibly
+        agents[index].player.rng = random.Random(rng.getrandbits(32))
+    with contextlib.redirect_stdout(sys.stderr):
+        draws, wins_a, wins_b = Referee(tournament_players[a].size).play_matches(agents[a], agents[b], n_games)
+    return a, b, wins_a, wins_b, draws
+
+
+def elo_ratings(wins, draws, prior=1.0):
+    """
+    Estimate Elo ratings from the results with a Bradley-Terry fit, draws counting as half a win.
+    Each pair that met gets prior virtual draws so that unbeaten policies get a finite rating.
+
+    :param wins: numpy array, wins[i][j] is the number of wins of i against j.
+    :param draws: numpy array of draws, symmetric.
+    :param prior: virtual draws per pair.
+    :return: numpy array of ratings, 0 on average.
+    """
+    games = wins + wins.T + draws
+    games = games + prior * (games > 0)
+    score = wins + 0.5 * (games - wins - wins.T)
+    gamma = np.ones(len(wins))
+    for iteration in range(10000):
+        denominator = (games / (gamma[:, None] + gamma[None, :])).sum(axis=1)
+        updated = np.where(denominator > 0, score.sum(axis=1) / np.maximum(denominator, 1e-12), gamma)
+        updated /= np.exp(np.log(updated).mean())
+        if np.allclose(updated, gamma, rtol=1e-10, atol=0):
+            break
+        gamma = updated
+    return 400 * np.log10(gamma)
+
+
+def run_tournament(paths, games, workers=1, gauntlet=False, chunk_size=50, seed=None, size=BOARD_ROWS):
+    """
+    Play a round-robin (or a gauntlet of the first policy against the others) between saved policies
+    on a process pool, with the exploration rate at 0 and the colors alternating.
+
+    :param paths: policy files written by savePolicy.
+    :param games: number of games per pair of policies.
+    :param workers: number of worker processes.
+    :param gauntlet: pair the first policy with each other one only.
+    :param chunk_size: games per task sent to a worker.
+    :param seed: seed of the tie-breaking.
+    :param size: size of the board the policies were trained on.
+    :return: (wins, draws) numpy arrays, wins[i][j] is the number of wins of policy i against policy j.
+    """
+    n = len(paths)
+    pairs = [(0, j) for j in range(1, n)] if gauntlet else [(i, j) for i in range(n) for j in range(i + 1, n)]
+    rng = random.Random(seed)
+    tasks = []
+    for a, b in pairs:
+        for start in range(0, games, chunk_size):
+            # Chunks of an even number of games keep the colors balanced
+            tasks.append((a, b, min(chunk_size, games - start), rng.getrandbits(32)))
+    wins = np.zeros((n, n), dtype=np.int64)
+    draws = np.zeros((n, n), dtype=np.int64)
+    if workers > 1:
+        with multiprocessing.Pool(workers, initializer=tournament_worker_init, initargs=(paths, size)) as pool:
+            results = list(pool.imap_unordered(tournament_match, tasks))
+    else:
+        tournament_worker_init(paths, size)
+        results = [tournament_match(task) for task in tasks]
+    for a, b, wins_a, wins_b, n_draws in results:
+        wins[a, b] += wins_a
+        wins[b, a] += wins_b
+        draws[a, b] += n_draws
+        draws[b, a] += n_draws
+    return wins, draws
+
+
+def print_tournament(paths, wins, draws):
+    """Print the win/draw/loss matrix, row against column, and the ratings"""
+    ratings = elo_ratings(wins, draws)
+    width = max(len(path) for path in paths)
+    print("{:<{}}  ".format("W/D/L", width) + " ".join("{:>14}".format("#{}".format(j)) for j in range(len(paths))))
+    for i, path in enumerate(paths):
+        cells = []
+        for j in range(len(paths)):
+            played = wins[i, j] + wins[j, i] + draws[i, j]
+            cells.append("{:>14}".format("{}/{}/{}".format(wins[i, j], draws[i, j], wins[j, i]) if played else "-"))
+        print("{:<{}}  ".format(path, width) + " ".join(cells))
+    print()
+    print("{:<4}{:<{}}  {:>8}  {:>7}  {:>6}".format("#", "policy", width, "elo", "score", "games"))
+    for i in np.argsort(-ratings):
+        played = wins[i].sum() + wins[:, i].sum() + draws[i].sum()
+        score = (wins[i].sum() + 0.5 * draws[i].sum()) / max(played, 1)
+        print("{:<4}{:<{}}  {:>8.1f}  {:>6.1f}%  {:>6}".format("#{}".format(i), paths[i], width, ratings[i],
+                                                                100 * score, played))
 
 
 if __name__ == "__main__":
-    go = GO(5)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=BOARD_ROWS, choices=BOARD_SIZES, metavar="N",
+                        help="board size, from 5 to 19")
+    parser.add_argument("--area-scoring", action="store_true",
+                        help="judge the training games by stones plus surrounded territory")
+    parser.add_argument("--replay", type=int, default=0, metavar="STATES",
+                        help="keep the last games of each player in a replay buffer of this many states, 0 is off")
+    parser.add_argument("--replay-path", metavar="DIR", help="memory-map the replay buffers in DIR/player1 and DIR/player2")
+    parser.add_argument("--replay-batch", type=int, default=8, help="stored games replayed after each new game")
+    parser.add_argument("--prioritized", action="store_true", help="replay the games whose values moved most more often")
+    parser.add_argument("--backup", choices=["serial", "batch", "exact"], default="serial",
+                        help="how the --workers learner feeds the rewards: game by game, or batched by chunk "
+                             "with NumPy, exact giving the same values as serial")
+    parser.add_argument("--save-every", type=int, default=2500000, help="games between two policy saves or checkpoints")
+    parser.add_argument("--checkpoint", metavar="PATH",
+                        help="append the value changes and training state to PATH every --save-every games, "
+                             "in the background, instead of saving the full policies")
+    parser.add_argument("--resume", action="store_true", help="continue the training saved in --checkpoint")
+    parser.add_argument("--compact-every", type=int, default=10,
+                        help="checkpoints between two rewrites of the log with the latest values only, 0 is never")
+    parser.add_argument("--workers", type=int, default=1, help="self-play processes, 1 plays in this process")
+    parser.add_argument("--sync-after", type=int, default=10000, help="games between two table snapshots sent to the workers")
+    parser.add_argument("--convert-policy", nargs=2, metavar=("PICKLE", "OUTPUT"),
+                        help="convert a pickled policy to the binary policy format and exit")
+    parser.add_argument("--symbol", type=int, default=1, help="piece type of the player owning the converted policy")
+    parser.add_argument("--report-every", type=int, default=0,
+                        help="print games/s, moves/s, table sizes and time per phase every N games, 0 is off")
+    parser.add_argument("--profile", metavar="FIRST:LAST",
+                        help="run games FIRST to LAST under cProfile, also turns the phase timers on")
+    parser.add_argument("--profile-output", default="profile.out", help="file receiving the cProfile stats")
+    parser.add_argument("--referee", nargs=2, metavar=("AGENT1", "AGENT2"),
+                        help="referee matches between two agents and exit: tcp:HOST:PORT, file:DIR:COMMAND, "
+                             "policy:PATH or a command speaking the line protocol on stdin/stdout")
+    parser.add_argument("--matches", type=int, default=1, help="games played by --referee, colors alternate")
+    parser.add_argument("--verbose", action="store_true", help="print the boards of the refereed games")
+    parser.add_argument("--serve-agent", metavar="POLICY",
+                        help="answer referee moves with a policy on stdin/stdout, or on --port, and exit")
+    parser.add_argument("--port", type=int,
+                        help="serve --serve-agent on this local port, to many concurrent games at once")
+    parser.add_argument("--cache-size", type=int, default=100000, help="positions in the move cache of --port")
+    parser.add_argument("--batch-size", type=int, default=256, help="most positions --port evaluates together")
+    parser.add_argument("--batch-window", type=float, default=0.5,
+                        help="milliseconds a --port request waits for others to share its evaluation")
+    parser.add_argument("--tournament", nargs="+", metavar="POLICY",
+                        help="play saved policies against each other on --workers processes and exit")
+    parser.add_argument("--gauntlet", action="store_true", help="pair the first --tournament policy with the others only")
+    parser.add_argument("--games", type=int, default=100, help="games per pair of --tournament policies")
+    parser.add_argument("--seed", type=int, help="seed of the --tournament tie-breaking")
+    args = parser.parse_args()
+
+    if args.convert_policy:
+        converter = Player(name="converter", typ="computer", symbol=args.symbol, size=args.size)
+        count = convert_policy(args.convert_policy[0], args.convert_policy[1], key_fn=converter.legacyHash)
+        print("Converted {} states to {}".format(count, args.convert_policy[1]))
+        sys.exit(0)
+
+    if args.referee:
+        agents = [connect_agent(spec, args.size) for spec in args.referee]
+        try:
+            ties, wins1, wins2 = Referee(args.size, verbose=args.verbose).play_matches(agents[0], agents[1], args.matches)
+        finally:
+            for agent in agents:
+                agent.close()
+        print("{} wins {}, {} wins {}, ties {}".format(args.referee[0], wins1, args.referee[1], wins2, ties))
+        sys.exit(0)
+
+    if args.tournament:
+        start = time.time()
+        wins, draws = run_tournament(args.tournament, args.games, workers=args.workers, gauntlet=args.gauntlet,
+                                     seed=args.seed, size=args.size)
+        print_tournament(args.tournament, wins, draws)
+        print("{} games in {:.1f}s".format((wins.sum() + draws.sum() // 2), time.time() - start))
+        sys.exit(0)
+
+    if args.serve_agent:
+        server_player = Player(name="agent", typ="computer", symbol=args.symbol, size=args.size)
+        server_player.loadPolicy(args.serve_agent, mmap=True)
+        if args.port is None:
+            serve_agent(server_player)
+        else:
+            server = MoveServer(server_player, cache_size=args.cache_size, batch_size=args.batch_size,
+                                batch_window=args.batch_window / 1000)
+            try:
+                asyncio.run(server.serve("127.0.0.1", args.port))
+            except KeyboardInterrupt:
+                print("Served {} moves from the cache and {} in {} batches".format(
+                    server.hits, server.evaluated, server.batches), file=sys.stderr)
+        sys.exit(0)
+
+    go = GO(args.size)
+    go.area_scoring = args.area_scoring
     num_games = 7500000  # Total number of games you want you agents to Play.
-    save_policy_after = 2500000  # After how many games do you want to save the policy.
+    save_policy_after = args.save_every  # After how many games do you want to save the policy.
     learning_rate_decay = 500000  # After how many games do you want your learning rate to decay.
-    player1 = Player(name="player1", typ="manual", symbol=1)
-    player2 = Player(name="player2", typ="manual", symbol=2)
+    player1 = Player(name="player1", typ="manual", symbol=1, size=args.size)
+    player2 = Player(name="player2", typ="manual", symbol=2, size=args.size)
     Start_time = time.time()
 
     # Below Code should be used when you already have your policy.
@@ -877,23 +2560,58 @@ if __name__ == "__main__":
     # print("Length of state_value for player 1:", len(player1.states_value))
     # print("Length of state_value for player 2:", len(player2.states_value))
 
-    for i in range(num_games):
-        go.play(player1=player1, player2=player2)
-        player1.reset()
-        player2.reset()
-        if i % save_policy_after == 0:
-            print("Rounds {}".format(i))
-            player1.savePolicy(i + save_policy_after)
-            player2.savePolicy(i + save_policy_after)
-        if i % learning_rate_decay == 0:
-            player1.exp_rate = player1.exp_rate * 0.9
-            player2.exp_rate = player2.exp_rate * 0.9
-            print("Current Exp Rate:-", player1.exp_rate)
+    if args.replay:
+        for player in (player1, player2):
+            player.replay = ReplayBuffer(args.replay, batch_size=args.replay_batch, prioritized=args.prioritized,
+                                         path=os.path.join(args.replay_path, player.name) if args.replay_path else None)
+
+    first_game = 0
+    checkpoint = None
+    if args.checkpoint:
+        if os.path.exists(args.checkpoint):
+            if not args.resume:
+                parser.error("{} exists, add --resume to continue its training".format(args.checkpoint))
+            tables, state = load_checkpoint(args.checkpoint)
+            first_game = restore_training_state(state, tables, player1, player2)
+            print("Resuming after game {}".format(first_game))
+        checkpoint = Checkpointer(args.checkpoint, compact_every=args.compact_every)
+
+    stats = None
+    if args.report_every or args.profile:
+        stats = Instrumentation(report_every=args.report_every,
+                                profile_window=tuple(int(x) for x in args.profile.split(":")) if args.profile else None,
+                                profile_path=args.profile_output,
+                                tables=lambda: {"player1": len(player1.states_value),
+                                                "player2": len(player2.states_value)})
+        go.stats = player1.stats = player2.stats = stats
+        player1.states_value.stats = player2.states_value.stats = stats
+
+    if args.workers > 1:
+        train_parallel(player1, player2, num_games, args.workers, save_policy_after, learning_rate_decay,
+                       sync_after=args.sync_after, stats=stats, area_scoring=args.area_scoring,
+                       backup=args.backup, first_game=first_game, checkpoint=checkpoint)
+    else:
+        for i in range(first_game, num_games):
+            go.play(player1=player1, player2=player2)
+            if stats is not None:
+                stats.end_game(go.n_move)
+            player1.reset()
+            player2.reset()
+            training_schedule(i, player1, player2, save_policy_after, learning_rate_decay, stats, checkpoint)
+    if checkpoint is not None:
+        checkpoint.save({player1.name: player1.states_value, player2.name: player2.states_value},
+                        training_state(num_games, player1, player2))
+        checkpoint.close()
+    if stats is not None:
+        stats.close()
     print("Program Complete")
     print("Length of state_value for player 1:", len(player1.states_value))
     print("Length of state_value for player 2:", len(player2.states_value))
     player1.savePolicy(i=num_games)
     player2.savePolicy(i=num_games)
+    for player in (player1, player2):
+        if player.replay is not None:
+            player.replay.flush()
     print("Total Execution time ::", time.time() - Start_time)
 
     # judge(args.move, args.verbose)
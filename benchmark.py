@@ -0,0 +1,381 @@
+import os
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import tempfile
+import contextlib
+import importlib.util
+from copy import deepcopy
+import numpy as np
+
+import ticTacToe
+from value_table import ValueTable
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_go_game():
+    '''
+    Import Go-Game.py, whose name is not a valid module name.
+
+    :param: None.
+    :return: the module.
+    '''
+    spec = importlib.util.spec_from_file_location('go_game', os.path.join(HERE, 'Go-Game.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def measure(name, run, ops, setup=None, repeat=3):
+    '''
+    Time a benchmark, keeping the best of a few runs.
+
+    :param name: benchmark name.
+    :param run: function doing ops operations, called with the result of setup.
+    :param ops: number of operations done by one call of run.
+    :param setup: function preparing the state of one run, not timed.
+    :param repeat: number of runs.
+    :return: dict with the name, ops, seconds, ns/op and ops/sec of the best run.
+    '''
+    best = None
+    for r in range(repeat):
+        state = setup() if setup is not None else None
+        start = time.perf_counter()
+        run(state)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    result = {'name': name, 'ops': ops, 'seconds': best,
+              'ns_per_op': best / ops * 1e9, 'ops_per_sec': ops / best if best > 0 else float('inf')}
+    print('{:<32} {:>14.0f} ns/op {:>14.1f} ops/sec'.format(name, result['ns_per_op'], result['ops_per_sec']))
+    return result
+
+
+@contextlib.contextmanager
+def quiet():
+    # The games print boards and progress, keep them out of the report
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def go_positions(g, count, seed):
+    '''
+    Collect positions from random games.
+
+    :param g: Go-Game module.
+    :param count: number of positions.
+    :param seed: random seed.
+    :return: list of (piece type to move, previous board, board).
+    '''
+    rng = random.Random(seed)
+    go = g.GO(g.BOARD_ROWS)
+    go.verbose = False
+    positions = []
+    while len(positions) < count:
+        go.init_board(go.size)
+        piece_type = 1
+        for n_move in range(go.max_move):
+            positions.append((piece_type, go.previous_board, go.board))
+            candidates = [(i, j) for i in range(go.size) for j in range(go.size)
+                          if go.valid_place_check(i, j, piece_type, test_check=True)]
+            if not candidates:
+                break
+            i, j = rng.choice(candidates)
+            go.place_chess(i, j, piece_type)
+            go.died_pieces = go.remove_died_pieces(3 - piece_type)
+            piece_type = 3 - piece_type
+    return positions[:count]
+
+
+def go_snapshot(go, piece_type):
+    # What apply_move changes: stones, hashes, ko and superko history, captures and legal moves
+    return (go.stones[1], go.stones[2], go.position_hash, go.symmetry_hash, go.previous_stones, go.previous_hash,
+            dict(go.history), list(go.died_pieces), go.last_move, list(go.stone_count),
+            go.legal_moves(piece_type), go.legal_moves(3 - piece_type))
+
+
+def check_undo(go, piece_type, moves):
+    '''
+    Play each move, and an answer to it, with apply_move and take them back with undo_move. After every step
+    the board must match a copy that only played the moves, and be as it was once they are undone.
+
+    :param go: GO instance, left as it was.
+    :param piece_type: 1('X') or 2('O'), the player to move.
+    :param moves: valid placements of the player.
+    :return: None, raises AssertionError on the first mismatch.
+    '''
+    before = go_snapshot(go, piece_type)
+    for i, j in moves:
+        played = deepcopy(go)
+        captured = go.apply_move(i, j, piece_type)
+        assert captured == played.apply_move(i, j, piece_type), (i, j)
+        answers = go.legal_moves(3 - piece_type)  # bit mask, answered on its lowest point
+        if answers:
+            a, b = divmod((answers & -answers).bit_length() - 1, go.size)
+            go.apply_move(a, b, 3 - piece_type)
+            go.undo_move()
+        assert go_snapshot(go, 3 - piece_type) == go_snapshot(played, 3 - piece_type), (i, j)
+        go.undo_move()
+        assert go_snapshot(go, piece_type) == before, (i, j)
+
+
+def trained_go_players(g, games, seed):
+    '''
+    Two Go players trained by self-play, so that their lookups mostly hit.
+
+    :param g: Go-Game module.
+    :param games: number of training games.
+    :param seed: random seed.
+    :return: (player1, player2).
+    '''
+    random.seed(seed)
+    go = g.GO(g.BOARD_ROWS)
+    player1 = g.Player(name="player1", typ="manual", symbol=1, seed=seed)
+    player2 = g.Player(name="player2", typ="manual", symbol=2, seed=seed + 1)
+    player1.verbose = player2.verbose = False
+    with quiet():
+        for i in range(games):
+            go.play(player1=player1, player2=player2)
+            player1.reset()
+            player2.reset()
+    return player1, player2
+
+
+def bench_go(g, args):
+    results = []
+    positions = go_positions(g, args.positions, args.seed)
+    games = []
+    for piece_type, previous_board, board in positions:
+        go = g.GO(g.BOARD_ROWS)
+        go.verbose = False
+        go.set_board(piece_type, previous_board, board)
+        moves = [(i, j) for i in range(go.size) for j in range(go.size)
+                 if go.valid_place_check(i, j, piece_type, test_check=True)]
+        games.append((go, piece_type, moves))
+    points = [(i, j) for i in range(g.BOARD_ROWS) for j in range(g.BOARD_COLS)]
+
+    def run_valid_place_check(state):
+        for go, piece_type, moves in games:
+            for i, j in points:
+                go.valid_place_check(i, j, piece_type, test_check=True)
+    results.append(measure('go.valid_place_check', run_valid_place_check, len(games) * len(points)))
+
+    # place_chess changes the board, each run gets its own copies
+    placements = [(go, piece_type, moves[k % len(moves)]) for k, (go, piece_type, moves) in enumerate(games) if moves]
+
+    def run_place_chess(copies):
+        for go, piece_type, (i, j) in copies:
+            go.place_chess(i, j, piece_type)
+    results.append(measure('go.place_chess', run_place_chess, len(placements),
+                           setup=lambda: [(deepcopy(go), piece_type, move) for go, piece_type, move in placements]))
+
+    # find_died_pieces right after the stone is placed, before the captures are removed
+    placed = []
+    for go, piece_type, (i, j) in placements:
+        go = deepcopy(go)
+        go.place_chess(i, j, piece_type)
+        placed.append((go, 3 - piece_type))
+
+    def run_find_died_pieces(state):
+        for go, piece_type in placed:
+            go.find_died_pieces(piece_type)
+    results.append(measure('go.find_died_pieces', run_find_died_pieces, len(placed)))
+
+    # Every valid move tried in place and taken back, checked against copies first
+    for go, piece_type, moves in games:
+        check_undo(go, piece_type, moves)
+
+    def run_apply_undo(state):
+        for go, piece_type, moves in games:
+            for i, j in moves:
+                go.apply_move(i, j, piece_type)
+                go.undo_move()
+    results.append(measure('go.apply_move/undo_move', run_apply_undo,
+                           sum(len(moves) for go, piece_type, moves in games)))
+
+    player1, player2 = trained_go_players(g, args.train_games, args.seed)
+    players = {1: player1, 2: player2}
+    lookups = []  # greedy players, the value lookups are what is measured
+    for go, piece_type, moves in games:
+        if moves:
+            player = g.Player(name="bench", typ="computer", symbol=piece_type, seed=args.seed)
+            player.exp_rate = 0
+            player.verbose = False
+            player.states_value = players[piece_type].states_value
+            player.go.set_board(piece_type, go.previous_board, go.board)
+            lookups.append((player, moves))
+
+    def run_get_input(state):
+        with quiet():
+            for player, moves in lookups:
+                player.get_input()
+    results.append(measure('player.get_input', run_get_input, len(lookups)))
+
+    def run_choose_action(state):
+        for player, moves in lookups:
+            player.chooseAction(moves)
+    results.append(measure('player.chooseAction', run_choose_action, len(lookups)))
+
+    # feedReward on the trajectories of recorded games
+    trajectories = []
+    with quiet():
+        go = g.GO(g.BOARD_ROWS)
+        for k in range(args.game_count):
+            go.play(player1=player1, player2=player2)
+            trajectories.append(player1.states)
+            player1.reset()
+            player2.reset()
+    n_states = sum(len(states) for states in trajectories)
+
+    def run_feed_reward(player):
+        for states in trajectories:
+            player.states = states
+            player.feedReward(1)
+    results.append(measure('player.feedReward (per state)', run_feed_reward, n_states,
+                           setup=lambda: deepcopy(player1)))
+
+    # Whole games, the players keep learning through GO.play
+    for player in players.values():
+        player.exp_rate = 0.3
+
+    def run_play(state):
+        go = g.GO(g.BOARD_ROWS)
+        with quiet():
+            for k in range(args.game_count):
+                go.play(player1=player1, player2=player2)
+                player1.reset()
+                player2.reset()
+    results.append(measure('go.play (games)', run_play, args.game_count))
+    return results
+
+
+def bench_tic_tac_toe(args):
+    results = []
+
+    def setup():
+        np.random.seed(args.seed)
+        p1, p2 = ticTacToe.Agent("p1"), ticTacToe.Agent("p2")
+        # State.play decays the rates through the module level players
+        ticTacToe.p1, ticTacToe.p2 = p1, p2
+        return p1, p2
+
+    def run_state_play(agents):
+        with quiet():
+            ticTacToe.State(*agents).play(args.ttt_games)
+    results.append(measure('ttt State.play (games)', run_state_play, args.ttt_games, setup=setup))
+
+    def run_batch_play(agents):
+        with quiet():
+            ticTacToe.BatchState(*agents, seed=args.seed).play(args.ttt_games * 10)
+    results.append(measure('ttt BatchState.play (games)', run_batch_play, args.ttt_games * 10, setup=setup))
+    return results
+
+
+def filled_table(size, seed):
+    '''
+    A value table with random keys.
+
+    :param size: number of entries.
+    :param seed: random seed.
+    :return: ValueTable instance.
+    '''
+    rng = np.random.default_rng(seed)
+    keys = np.unique(rng.integers(0, 2 ** 63, size, dtype=np.int64).astype(np.uint64))
+    table = ValueTable(int(len(keys) / 0.75) + 1)
+    table.values[table.find_slots(keys, insert=True)] = rng.random(len(keys), dtype=np.float32)
+    return table
+
+
+def bench_policy_io(g, args):
+    results = []
+    player = g.Player(name="bench", typ="computer", symbol=1)
+    with tempfile.TemporaryDirectory() as directory:
+        cwd = os.getcwd()
+        os.chdir(directory)  # savePolicy writes in the working directory
+        try:
+            for size in args.policy_sizes:
+                player.states_value = filled_table(size, args.seed)
+                path = '0run_policy_bench'
+                results.append(measure('savePolicy {}'.format(size), lambda state: player.savePolicy(0), size,
+                                       repeat=1 if size >= 10 ** 6 else 3))
+                loader = g.Player(name="loader", typ="computer", symbol=1)
+                results.append(measure('loadPolicy {}'.format(size), lambda state: loader.loadPolicy(path), size,
+                                       repeat=1 if size >= 10 ** 6 else 3))
+                # Opening with mmap reads no entry, it is timed per file
+                results.append(measure('loadPolicy mmap {} (per file)'.format(size),
+                                       lambda state: loader.loadPolicy(path, mmap=True), 1))
+                loader.states_value = None
+                player.states_value = None
+                os.remove(path)
+        finally:
+            os.chdir(cwd)
+    return results
+
+
+def compare(results, baseline_path, threshold):
+    '''
+    Print the benchmarks that got slower than in a baseline report.
+
+    :param results: list of results.
+    :param baseline_path: JSON report of an earlier run.
+    :param threshold: slowdown ratio reported as a regression.
+    :return: number of regressions.
+    '''
+    with open(baseline_path) as f:
+        baseline = {result['name']: result for result in json.load(f)['results']}
+    regressions = 0
+    for result in results:
+        before = baseline.get(result['name'])
+        if before is None:
+            continue
+        ratio = result['ns_per_op'] / before['ns_per_op']
+        if ratio > threshold:
+            regressions += 1
+            print('REGRESSION {}: {:.0f} -> {:.0f} ns/op ({:.2f}x)'.format(
+                result['name'], before['ns_per_op'], result['ns_per_op'], ratio))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the Go and tic-tac-toe hot paths.")
+    parser.add_argument("--output", default="benchmark.json", help="JSON report file")
+    parser.add_argument("--only", choices=["go", "ttt", "policy"], action="append",
+                        help="run only these groups, all of them by default")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--positions", type=int, default=2000, help="Go positions for the engine benchmarks")
+    parser.add_argument("--train-games", type=int, default=2000, help="self-play games filling the Go value tables")
+    parser.add_argument("--game-count", type=int, default=200, help="Go games for the whole game benchmarks")
+    parser.add_argument("--ttt-games", type=int, default=2000, help="tic-tac-toe games for State.play")
+    parser.add_argument("--policy-sizes", type=lambda s: [int(float(x)) for x in s.split(",")],
+                        default=[10 ** 4, 10 ** 6, 10 ** 7], help="comma separated entry counts, e.g. 1e4,1e6")
+    parser.add_argument("--compare", metavar="BASELINE", help="JSON report to compare against")
+    parser.add_argument("--threshold", type=float, default=1.2, help="slowdown ratio counted as a regression")
+    args = parser.parse_args()
+
+    groups = args.only or ["go", "ttt", "policy"]
+    g = load_go_game()
+    results = []
+    if "go" in groups:
+        results += bench_go(g, args)
+    if "ttt" in groups:
+        results += bench_tic_tac_toe(args)
+    if "policy" in groups:
+        results += bench_policy_io(g, args)
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'args': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print("Results written to {}".format(args.output))
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
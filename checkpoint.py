@@ -0,0 +1,161 @@
+import os
+import queue
+import pickle
+import struct
+import threading
+import numpy as np
+
+from value_table import ValueTable
+
+RECORD_HEADER = struct.Struct('<Q')  # length of the pickled record that follows
+
+
+def read_records(path):
+    '''
+    Read the records of a checkpoint log, stopping at a record cut short by a crash.
+
+    :param path: checkpoint log.
+    :return: generator of (record, offset of the end of the record).
+    '''
+    with open(path, 'rb') as f:
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            data = f.read(RECORD_HEADER.unpack(header)[0])
+            if len(data) < RECORD_HEADER.unpack(header)[0]:
+                return
+            yield pickle.loads(data), f.tell()
+
+
+def merge_records(records):
+    '''
+    Replay delta records, the latest value of a key winning.
+
+    :param records: iterable of records.
+    :return: ({table name: (uint64 array of keys, float32 array of values)}, state of the last record).
+    '''
+    parts = {}
+    state = None
+    for record in records:
+        for name, (keys, values) in record['tables'].items():
+            parts.setdefault(name, []).append((keys, values))
+        state = record['state']
+    tables = {}
+    for name, deltas in parts.items():
+        keys = np.concatenate([keys for keys, values in deltas])
+        values = np.concatenate([values for keys, values in deltas])
+        # Last occurrence of every key: first one in the reversed arrays
+        unique, first = np.unique(keys[::-1], return_index=True)
+        tables[name] = (unique, values[::-1][first])
+    return tables, state
+
+
+def load_checkpoint(path):
+    '''
+    Load the value tables and the training state of the last complete checkpoint.
+    The tables track their changes, so the next checkpoint only holds what changed after the resume.
+
+    :param path: checkpoint log.
+    :return: ({table name: ValueTable}, state).
+    '''
+    arrays, state = merge_records(record for record, end in read_records(path))
+    tables = {}
+    for name, (keys, values) in arrays.items():
+        tables[name] = ValueTable.from_arrays(keys, values)
+        tables[name].take_changes()
+    return tables, state
+
+
+class Checkpointer:
+    def __init__(self, path, compact_every=10):
+        '''
+        Append-only checkpoint log of value tables. Each checkpoint takes the entries changed since the
+        previous one, which costs time in proportion to the changes, and a background thread appends them
+        with the training state as one record. Every compact_every records the log is rewritten as one
+        record holding the latest values, so it does not keep growing with old values.
+
+        :param path: log file, appended to when it exists.
+        :param compact_every: records between two compactions, 0 for none.
+        '''
+        self.path = path
+        self.compact_every = compact_every
+        self.records = 0
+        self.error = None
+        if os.path.exists(path):
+            # Drop a record cut short by a crash, new records go after the last complete one
+            end = 0
+            for record, end in read_records(path):
+                self.records += 1
+            with open(path, 'r+b') as f:
+                f.truncate(end)
+        self.pending = queue.Queue(maxsize=2)  # Bounded, a slow disk slows training down instead of using memory
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def save(self, tables, state):
+        '''
+        Take the changes of the tables and queue them for writing, along with the training state.
+
+        :param tables: {table name: ValueTable}.
+        :param state: picklable training state restored on resume.
+        :return: None.
+        '''
+        self.check()
+        record = {'tables': {name: table.take_changes() for name, table in tables.items()}, 'state': state}
+        self.pending.put(record)
+
+    def run(self):
+        while True:
+            record = self.pending.get()
+            if record is None:
+                return
+            try:
+                self.write(record)
+            except Exception as error:  # Reported to the training thread by the next save or close
+                self.error = error
+
+    def write(self, record):
+        data = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+        with open(self.path, 'ab') as f:
+            f.write(RECORD_HEADER.pack(len(data)))
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self.records += 1
+        if self.compact_every and self.records % self.compact_every == 0:
+            self.compact()
+
+    def compact(self):
+        '''
+        Rewrite the log as a single record, renaming it over the old one so a crash keeps either of them.
+
+        :param: None.
+        :return: None.
+        '''
+        tables, state = merge_records(record for record, end in read_records(self.path))
+        data = pickle.dumps({'tables': tables, 'state': state}, protocol=pickle.HIGHEST_PROTOCOL)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(RECORD_HEADER.pack(len(data)))
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self.records = 1
+
+    def check(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError('Writing the checkpoint {} failed.'.format(self.path)) from error
+
+    def close(self):
+        '''
+        Wait for the queued checkpoints to be written.
+
+        :param: None.
+        :return: None.
+        '''
+        self.pending.put(None)
+        self.thread.join()
+        self.check()
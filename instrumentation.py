@@ -0,0 +1,122 @@
+import sys
+import time
+import cProfile
+
+clock = time.perf_counter
+
+
+class Instrumentation:
+    def __init__(self, report_every=10000, profile_window=None, profile_path='profile.out', tables=None,
+                 out=None):
+        '''
+        Counters and timers for the training loops. The loops hold None instead of an instance when
+        instrumentation is off, so each hook costs one test. Phases are timed by the callers:
+            start = clock() ... stats.add('place', clock() - start)
+
+        :param report_every: games between two reports, 0 for no periodic report.
+        :param profile_window: (first game, last game) to run under cProfile, or None.
+        :param profile_path: file receiving the cProfile stats of the window.
+        :param tables: function returning {name: number of entries} of the value tables, for the reports.
+        :param out: stream of the reports, sys.stdout by default.
+        '''
+        self.report_every = report_every
+        self.profile_window = profile_window
+        self.profile_path = profile_path
+        self.tables = tables
+        self.out = out
+        self.timers = {}  # phase -> seconds
+        self.counters = {}  # name -> count
+        self.games = 0
+        self.moves = 0
+        self.start = clock()
+        self.last_report = (self.start, 0, 0)  # (time, games, moves) of the previous report
+        self.profiler = None
+        if profile_window is not None and profile_window[0] <= 0:
+            self.start_profile()
+
+    def add(self, phase, seconds, count=1):
+        '''
+        Add time spent in a phase.
+
+        :param phase: phase name.
+        :param seconds: time spent.
+        :param count: number of calls it covers.
+        :return: None.
+        '''
+        self.timers[phase] = self.timers.get(phase, 0.0) + seconds
+        self.counters[phase] = self.counters.get(phase, 0) + count
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def end_game(self, moves, games=1):
+        '''
+        Count finished games, reporting and starting or stopping the profiler when due.
+
+        :param moves: number of moves played in them.
+        :param games: number of games.
+        :return: None.
+        '''
+        before = self.games
+        self.games += games
+        self.moves += moves
+        if self.profile_window is not None:
+            first, last = self.profile_window
+            if self.profiler is None and before < first <= self.games:
+                self.start_profile()
+            elif self.profiler is not None and self.games > last:
+                self.stop_profile()
+        if self.report_every and self.games // self.report_every != before // self.report_every:
+            self.report()
+
+    def start_profile(self):
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+
+    def stop_profile(self):
+        '''
+        Stop the profiler and write its stats, to be read with pstats or snakeviz.
+
+        :param: None.
+        :return: None.
+        '''
+        if self.profiler is None:
+            return
+        self.profiler.disable()
+        self.profiler.dump_stats(self.profile_path)
+        self.profiler = None
+        self.write("Profile of games {}-{} written to {}".format(self.profile_window[0], self.profile_window[1],
+                                                                  self.profile_path))
+
+    def write(self, line):
+        print(line, file=self.out or sys.stdout)
+
+    def report(self):
+        '''
+        Print the rates since the previous report, the table sizes and where the time went so far.
+
+        :param: None.
+        :return: None.
+        '''
+        now = clock()
+        last_time, last_games, last_moves = self.last_report
+        elapsed = max(now - last_time, 1e-9)
+        self.last_report = (now, self.games, self.moves)
+        line = "[stats] games {} | {:.1f} games/s | {:.1f} moves/s".format(
+            self.games, (self.games - last_games) / elapsed, (self.moves - last_moves) / elapsed)
+        if self.tables is not None:
+            line += " | tables " + " ".join("{}={}".format(name, size) for name, size in self.tables().items())
+        self.write(line)
+        total = max(now - self.start, 1e-9)
+        phases = sorted(self.timers.items(), key=lambda item: -item[1])
+        self.write("[stats] " + " | ".join("{} {:.2f}s {:.1f}% x{}".format(
+            phase, seconds, 100 * seconds / total, self.counters[phase]) for phase, seconds in phases))
+        others = [(name, n) for name, n in sorted(self.counters.items()) if name not in self.timers]
+        if others:
+            self.write("[stats] " + " ".join("{}={}".format(name, n) for name, n in others))
+
+    def close(self):
+        # Final report unless the last game was just reported, and the profile when the run ended inside the window
+        self.stop_profile()
+        if self.games != self.last_report[1] or not self.report_every:
+            self.report()
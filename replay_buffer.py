@@ -0,0 +1,157 @@
+import os
+import numpy as np
+
+EPISODE_FILES = ('states', 'starts', 'lengths', 'rewards', 'priorities', 'cursor')
+
+
+class ReplayBuffer:
+    def __init__(self, capacity=1 << 20, max_episodes=None, path=None, batch_size=32, prioritized=False,
+                 alpha=0.6, seed=None):
+        '''
+        Ring buffer of finished games for experience replay. The state keys of all the episodes share one
+        preallocated uint64 array, each episode is a (start, length, reward, priority) record, and the oldest
+        episodes are overwritten once the buffer is full. An episode is never split across the end of the ring.
+
+        With a path the arrays are memory-mapped .npy files in that directory, so the buffer can grow past
+        the memory. An existing buffer is opened again with its content and its own sizes.
+
+        :param capacity: number of state keys held.
+        :param max_episodes: number of episode records, capacity // 8 by default.
+        :param path: directory of the memory-mapped arrays, None keeps them in memory.
+        :param batch_size: episodes sampled by default.
+        :param prioritized: sample by priority instead of uniformly by default.
+        :param alpha: exponent of the priorities when sampling by priority, 0 is uniform.
+        :param seed: seed of the sampling.
+        '''
+        if max_episodes is None:
+            max_episodes = max(1, capacity // 8)
+        self.path = path
+        self.batch_size = batch_size
+        self.prioritized = prioritized
+        self.alpha = alpha
+        self.rng = np.random.default_rng(seed)
+        shapes = {'states': (capacity, np.uint64), 'starts': (max_episodes, np.int64),
+                  'lengths': (max_episodes, np.int64), 'rewards': (max_episodes, np.float32),
+                  'priorities': (max_episodes, np.float64), 'cursor': (3, np.int64)}
+        arrays = {}
+        if path is None:
+            for name, (size, dtype) in shapes.items():
+                arrays[name] = np.zeros(size, dtype=dtype)
+        else:
+            os.makedirs(path, exist_ok=True)
+            reopen = os.path.exists(os.path.join(path, 'cursor.npy'))
+            for name, (size, dtype) in shapes.items():
+                file = os.path.join(path, name + '.npy')
+                if reopen:
+                    arrays[name] = np.load(file, mmap_mode='r+')
+                else:
+                    arrays[name] = np.lib.format.open_memmap(file, mode='w+', dtype=dtype, shape=(size,))
+        self.states = arrays['states']
+        self.starts = arrays['starts']
+        self.lengths = arrays['lengths']
+        self.rewards = arrays['rewards']
+        self.priorities = arrays['priorities']
+        self.cursor = arrays['cursor']  # [next state position, slot of the oldest episode, number of episodes]
+        self.capacity = len(self.states)
+        self.max_episodes = len(self.starts)
+        live = self.slots()
+        self.max_priority = float(self.priorities[live].max()) if len(live) else 1.0
+
+    def __len__(self):
+        return int(self.cursor[2])
+
+    def slots(self):
+        '''
+        Get the slots of the stored episodes.
+
+        :return: int64 array of slots, oldest first.
+        '''
+        oldest, count = int(self.cursor[1]), int(self.cursor[2])
+        return (oldest + np.arange(count)) % self.max_episodes
+
+    def drop_oldest(self):
+        self.cursor[1] = (self.cursor[1] + 1) % self.max_episodes
+        self.cursor[2] -= 1
+
+    def add(self, states, reward, priority=None):
+        '''
+        Store a finished episode, dropping the oldest ones that are in the way.
+
+        :param states: state keys of the episode, in the order they were visited.
+        :param reward: final reward of the episode.
+        :param priority: sampling priority, the highest one seen so far by default so new episodes get replayed.
+        :return: slot of the episode, None for an empty episode.
+        '''
+        length = len(states)
+        if not length:
+            return None
+        if length > self.capacity:
+            raise ValueError('Episode of {} states does not fit a replay buffer of {}.'.format(length, self.capacity))
+        cursor = self.cursor
+        position = int(cursor[0])
+        starts = self.starts
+        if position + length > self.capacity:
+            # Not enough room before the end of the ring: the episodes left there are the oldest, drop them
+            while cursor[2] and starts[cursor[1]] >= position:
+                self.drop_oldest()
+            position = 0
+        while cursor[2] and (cursor[2] == self.max_episodes or position <= starts[cursor[1]] < position + length):
+            self.drop_oldest()
+        slot = int((cursor[1] + cursor[2]) % self.max_episodes)
+        self.states[position:position + length] = states
+        starts[slot] = position
+        self.lengths[slot] = length
+        self.rewards[slot] = reward
+        self.priorities[slot] = self.max_priority if priority is None else priority
+        cursor[0] = position + length
+        cursor[2] += 1
+        return slot
+
+    def sample(self, count=None, prioritized=None):
+        '''
+        Draw episodes with replacement, uniformly or in proportion to priority ** alpha.
+
+        :param count: number of episodes, batch_size by default.
+        :param prioritized: sample by priority, the buffer's setting by default.
+        :return: int64 array of slots.
+        '''
+        if count is None:
+            count = self.batch_size
+        if prioritized is None:
+            prioritized = self.prioritized
+        slots = self.slots()
+        if not len(slots):
+            return slots
+        if not prioritized:
+            return slots[self.rng.integers(len(slots), size=count)]
+        weights = self.priorities[slots] ** self.alpha
+        return slots[self.rng.choice(len(slots), size=count, p=weights / weights.sum())]
+
+    def episode(self, slot):
+        '''
+        Get a stored episode.
+
+        :param slot: slot of the episode.
+        :return: (uint64 array of state keys, reward).
+        '''
+        start = self.starts[slot]
+        return self.states[start:start + self.lengths[slot]], self.rewards.item(slot)
+
+    def update_priorities(self, slots, priorities):
+        '''
+        Set the priorities of replayed episodes, usually from the size of their value updates.
+
+        :param slots: slots of the episodes.
+        :param priorities: new priorities, small positive values keep the episodes reachable.
+        :return: None.
+        '''
+        priorities = np.maximum(np.asarray(priorities, dtype=np.float64), 1e-6)
+        self.priorities[slots] = priorities
+        if len(priorities):
+            self.max_priority = max(self.max_priority, float(priorities.max()))
+
+    def flush(self):
+        # Write the memory-mapped arrays to disk
+        if self.path is not None:
+            for name in EPISODE_FILES:
+                getattr(self, name).flush()
@@ -1,8 +1,66 @@
+import argparse
 import numpy as np
-import pickle
+
+from value_table import load_policy, backup_episodes
+from instrumentation import Instrumentation, clock
+from replay_buffer import ReplayBuffer
 
 BOARD_ROWS = 3
 BOARD_COLS = 3
+POWERS_OF_3 = 3 ** np.arange(BOARD_ROWS * BOARD_COLS)
+# The 8 rotations and reflections of the board, SYMMETRIES[t][p] is the image of cell p = row * 3 + col
+SYMMETRIES = np.array([[a * BOARD_COLS + b for a, b in (f(i, j) for i in range(BOARD_ROWS) for j in range(BOARD_COLS))]
+                       for f in [lambda i, j: (i, j), lambda i, j: (j, 2 - i), lambda i, j: (2 - i, 2 - j),
+                                 lambda i, j: (2 - j, i), lambda i, j: (i, 2 - j), lambda i, j: (j, i),
+                                 lambda i, j: (2 - i, j), lambda i, j: (2 - j, 2 - i)]])
+
+
+def build_canonical_keys():
+    # For every base 3 board number, the smallest number among its 8 symmetric boards. The colors are
+    # not swapped, that would give the player to move the other player's stones.
+    digits = np.arange(3 ** 9)[:, None] // POWERS_OF_3 % 3
+    variants = np.empty((3 ** 9, 8), dtype=np.int64)
+    for t, perm in enumerate(SYMMETRIES):
+        moved = np.empty_like(digits)
+        moved[:, perm] = digits
+        variants[:, t] = moved @ POWERS_OF_3
+    return variants.min(axis=1)
+
+
+CANONICAL_KEYS = build_canonical_keys()
+LINES = [[0, 1, 2], [3, 4, 5], [6, 7, 8], [0, 3, 6], [1, 4, 7], [2, 5, 8], [0, 4, 8], [2, 4, 6]]
+
+
+def build_state_tables():
+    # For every base 3 board number: the winner (1, -1, 0.5 for a tie, NaN while the game goes on),
+    # the bit mask of the empty cells and the board number after a move on each cell
+    # (-1 when taken), p1 moving when both players have as many stones
+    digits = np.arange(3 ** 9)[:, None] // POWERS_OF_3 % 3
+    cells = np.where(digits == 2, -1, digits)
+    line_sums = cells[:, LINES].sum(axis=2)
+    legal_masks = (digits == 0) @ (1 << np.arange(9))
+    winners = np.where(legal_masks == 0, 0.5, np.nan)
+    winners[(line_sums == -3).any(axis=1)] = -1
+    winners[(line_sums == 3).any(axis=1)] = 1
+    mover = np.where((digits == 1).sum(axis=1) == (digits == 2).sum(axis=1), 1, 2)
+    successors = np.arange(3 ** 9)[:, None] + mover[:, None] * POWERS_OF_3
+    successors[digits != 0] = -1
+    return winners.astype(np.float32), legal_masks.astype(np.uint16), successors.astype(np.int32)
+
+
+WINNERS, LEGAL_MASKS, SUCCESSORS = build_state_tables()
+# (row, col) of the empty cells of each legal move mask
+MASK_POSITIONS = [[(p // BOARD_COLS, p % BOARD_COLS) for p in range(9) if mask >> p & 1] for mask in range(1 << 9)]
+
+
+def board_code(board):
+    # base 3 number of the board, digit 1 for p1 (1) and 2 for p2 (-1)
+    return int(np.dot(board.reshape(BOARD_COLS * BOARD_ROWS).astype(np.int64) % 3, POWERS_OF_3))
+
+
+def board_key(board):
+    # key shared by the board, its rotations and reflections
+    return int(CANONICAL_KEYS[board_code(board)])
 
 
 class State:
@@ -10,63 +68,35 @@ class State:
         self.board = np.zeros((BOARD_ROWS, BOARD_COLS))
         self.p1 = p1
         self.p2 = p2
+        self.code = 0  # base 3 number of the board, index of the state tables
         self.isEnd = False
         self.boardHash = None
         # init p1 plays first
         self.playerSymbol = 1
+        self.stats = None  # Instrumentation timing the phases of play, None when off
 
     # get unique hash of current board state
     def getHash(self):
-        self.boardHash = str(self.board.reshape(BOARD_COLS * BOARD_ROWS))
+        self.boardHash = int(CANONICAL_KEYS[self.code])
         return self.boardHash
 
     def winner(self):
-        # row
-        for i in range(BOARD_ROWS):
-            if sum(self.board[i, :]) == 3:
-                self.isEnd = True
-                return 1
-            if sum(self.board[i, :]) == -3:
-                self.isEnd = True
-                return -1
-        # col
-        for i in range(BOARD_COLS):
-            if sum(self.board[:, i]) == 3:
-                self.isEnd = True
-                return 1
-            if sum(self.board[:, i]) == -3:
-                self.isEnd = True
-                return -1
-        # diagonal
-        diag_sum1 = sum([self.board[i, i] for i in range(BOARD_COLS)])
-        diag_sum2 = sum([self.board[i, BOARD_COLS - i - 1] for i in range(BOARD_COLS)])
-        diag_sum = max(abs(diag_sum1), abs(diag_sum2))
-        if diag_sum == 3:
-            self.isEnd = True
-            if diag_sum1 == 3 or diag_sum2 == 3:
-                return 1
-            else:
-                return -1
-
-        # tie
-        # no available positions
-        if len(self.availablePositions()) == 0:
-            self.isEnd = True
+        result = WINNERS.item(self.code)
+        if result != result:
+            # not end
+            self.isEnd = False
+            return None
+        self.isEnd = True
+        if result == 0.5:
             return 0.5
-        # not end
-        self.isEnd = False
-        return None
+        return int(result)
 
     def availablePositions(self):
-        positions = []
-        for i in range(BOARD_ROWS):
-            for j in range(BOARD_COLS):
-                if self.board[i, j] == 0:
-                    positions.append((i, j))  # need to be tuple
-        return positions
+        return list(MASK_POSITIONS[LEGAL_MASKS.item(self.code)])
 
     def updateState(self, position):
         self.board[position] = self.playerSymbol
+        self.code = SUCCESSORS.item(self.code, position[0] * BOARD_COLS + position[1])
         # switch to another player
         self.playerSymbol = -1 if self.playerSymbol == 1 else 1
 
@@ -87,6 +117,7 @@ class State:
     # board reset
     def reset(self):
         self.board = np.zeros((BOARD_ROWS, BOARD_COLS))
+        self.code = 0
         self.boardHash = None
         self.isEnd = False
         self.playerSymbol = 1
@@ -98,44 +129,86 @@ class State:
             if i % 10000 == 0:
                 p1.exp_rate = p1.exp_rate * 0.9
                 p2.exp_rate = p2.exp_rate * 0.9
+            stats = self.stats
             while not self.isEnd:
                 # Player 1
+                if stats is not None:
+                    start = clock()
                 positions = self.availablePositions()
+                if stats is not None:
+                    generated = clock()
                 p1_action = self.p1.chooseAction(positions, self.board, self.playerSymbol)
+                if stats is not None:
+                    chosen = clock()
                 # take action and upate board state
                 self.updateState(p1_action)
                 board_hash = self.getHash()
                 self.p1.addState(board_hash)
+                if stats is not None:
+                    placed = clock()
                 # check board status if it is end
 
                 win = self.winner()
+                if stats is not None:
+                    self.addPhases(stats, start, generated, chosen, placed)
                 if win is not None:
                     # self.showBoard()
                     # ended with p1 either win or draw
-                    self.giveReward()
-                    self.p1.reset()
-                    self.p2.reset()
-                    self.reset()
+                    self.endGame(stats)
                     break
 
                 else:
                     # Player 2
+                    if stats is not None:
+                        start = clock()
                     positions = self.availablePositions()
+                    if stats is not None:
+                        generated = clock()
                     p2_action = self.p2.chooseAction(positions, self.board, self.playerSymbol)
+                    if stats is not None:
+                        chosen = clock()
                     self.updateState(p2_action)
                     board_hash = self.getHash()
                     self.p2.addState(board_hash)
+                    if stats is not None:
+                        placed = clock()
 
                     win = self.winner()
+                    if stats is not None:
+                        self.addPhases(stats, start, generated, chosen, placed)
                     if win is not None:
                         # self.showBoard()
                         # ended with p2 either win or draw
-                        self.giveReward()
-                        self.p1.reset()
-                        self.p2.reset()
-                        self.reset()
+                        self.endGame(stats)
                         break
 
+    def addPhases(self, stats, start, generated, chosen, placed):
+        # time of the phases of one move, from the clock readings between them
+        stats.add('legal_moves', generated - start)
+        stats.add('select', chosen - generated)
+        stats.add('place', placed - chosen)
+        stats.add('winner', clock() - placed)
+
+    def endGame(self, stats):
+        # learn from the finished game and start a new one
+        if stats is not None:
+            start = clock()
+        self.giveReward()
+        if stats is not None:
+            stats.add('reward', clock() - start)
+        for agent in (self.p1, self.p2):
+            if agent.replay is not None:
+                if stats is not None:
+                    start = clock()
+                replayed = agent.replayGames()
+                if stats is not None:
+                    stats.add('replay', clock() - start, replayed)
+        if stats is not None:
+            stats.end_game(np.count_nonzero(self.board))
+        self.p1.reset()
+        self.p2.reset()
+        self.reset()
+
     # play with human
     def play2(self):
         while not self.isEnd:
@@ -189,6 +262,120 @@ class State:
         print('-------------')
 
 
+class BatchState:
+    # Trains two Agents on n_games games at once, boards held in one (N, 9) array.
+    # Follows State.play: epsilon-greedy moves, rewards 1 / 0 for a win, 0.1 / 0.5 for a tie,
+    # backed up along each finished game as in Agent.feedReward, and the exploration
+    # rates decayed every 10000 games. Moves of one step all see the values as they
+    # were before the games finished in that step were learned.
+    def __init__(self, p1, p2, n_games=1024, seed=None):
+        self.p1 = p1
+        self.p2 = p2
+        self.n_games = n_games
+        self.rng = np.random.default_rng(seed)
+        self.board = np.zeros((n_games, BOARD_ROWS * BOARD_COLS), dtype=np.int8)
+        self.code = np.zeros(n_games, dtype=np.int64)  # base 3 board numbers
+        # keys of the positions each agent moved to, p1 moves at most 5 times and p2 4 times
+        self.states = [np.zeros((n_games, 5), dtype=np.int64), np.zeros((n_games, 4), dtype=np.int64)]
+        self.n_move = np.zeros(n_games, dtype=np.int64)
+        self.stats = None  # Instrumentation timing the phases of play, None when off
+
+    def reset(self, games):
+        self.board[games] = 0
+        self.code[games] = 0
+        self.n_move[games] = 0
+
+    def chooseActions(self, agent, games):
+        # epsilon-greedy cells for the agent in the given games, the last best cell when greedy
+        legal = self.board[games] == 0
+        next_codes = SUCCESSORS[self.code[games]]
+        values = np.where(legal, agent.states_value[CANONICAL_KEYS[next_codes]], -np.inf)
+        actions = values.shape[1] - 1 - np.argmax(values[:, ::-1], axis=1)
+        explore = self.rng.uniform(0, 1, len(games)) <= agent.exp_rate
+        if explore.any():
+            # uniform among the empty cells
+            scores = np.where(legal[explore], self.rng.random((explore.sum(), legal.shape[1])), -1)
+            actions[explore] = np.argmax(scores, axis=1)
+        return actions
+
+    def feedRewards(self, agent, states, lengths, rewards):
+        # Agent.feedReward for many games, one position of the trajectories at a time.
+        # A key shows up at one position only (the number of stones tells it), and games
+        # sharing a key are applied one after the other in game order, so this is exact.
+        if agent.replay is not None:
+            for game in range(len(lengths)):
+                agent.replay.add(states[game, :lengths[game]], rewards[game])
+        backup_episodes(agent.states_value, states, lengths, rewards, agent.lr, agent.decay_gamma)
+
+    def countGames(self, first, count):
+        # report and decay the exploration rates as State.play does for games first .. first + count - 1
+        for i in range(first, first + count):
+            if i % 1000 == 0:
+                print("Rounds {}".format(i))
+            if i % 10000 == 0:
+                self.p1.exp_rate = self.p1.exp_rate * 0.9
+                self.p2.exp_rate = self.p2.exp_rate * 0.9
+
+    def play(self, rounds=100):
+        games_started = min(rounds, self.n_games)
+        self.countGames(0, games_started)
+        active = np.arange(self.n_games) < games_started
+        self.reset(active)
+        stats = self.stats
+        while active.any():
+            movers = [np.flatnonzero(active & (self.n_move % 2 == index)) for index in (0, 1)]
+            for index, agent, symbol in ((0, self.p1, 1), (1, self.p2, -1)):
+                games = movers[index]
+                if not len(games):
+                    continue
+                if stats is not None:
+                    start = clock()
+                actions = self.chooseActions(agent, games)
+                if stats is not None:
+                    chosen = clock()
+                    stats.add('select', chosen - start, len(games))
+                self.board[games, actions] = symbol
+                self.code[games] = SUCCESSORS[self.code[games], actions]
+                self.states[index][games, self.n_move[games] // 2] = CANONICAL_KEYS[self.code[games]]
+                self.n_move[games] += 1
+                if stats is not None:
+                    stats.add('place', clock() - chosen, len(games))
+            if stats is not None:
+                start = clock()
+            result = WINNERS[self.code]
+            finished = np.flatnonzero(active & ~np.isnan(result))
+            if stats is not None:
+                stats.add('winner', clock() - start)
+            if not len(finished):
+                continue
+            if stats is not None:
+                start = clock()
+            result = result[finished]
+            # p1 made the odd moves and p2 the even ones
+            self.feedRewards(self.p1, self.states[0][finished], (self.n_move[finished] + 1) // 2,
+                             np.select([result == 1, result == -1], [1, 0], 0.1))
+            self.feedRewards(self.p2, self.states[1][finished], self.n_move[finished] // 2,
+                             np.select([result == 1, result == -1], [0, 1], 0.5))
+            if stats is not None:
+                stats.add('reward', clock() - start, len(finished))
+                stats.end_game(int(self.n_move[finished].sum()), len(finished))
+            for agent in (self.p1, self.p2):
+                if agent.replay is not None:
+                    if stats is not None:
+                        start = clock()
+                    # as many replays per finished game as State.play does
+                    replayed = agent.replayGames(agent.replay.batch_size * len(finished))
+                    if stats is not None:
+                        stats.add('replay', clock() - start, replayed)
+            active[finished] = False
+            # start new games in place of the finished ones
+            restart = finished[:max(0, min(len(finished), rounds - games_started))]
+            self.countGames(games_started, len(restart))
+            games_started += len(restart)
+            self.reset(restart)
+            active[restart] = True
+
+
 class Agent:
     def __init__(self, name, exp_rate=0.6):
         self.name = name
@@ -196,10 +383,11 @@ class Agent:
         self.lr = 0.7
         self.exp_rate = exp_rate
         self.decay_gamma = 0.9
-        self.states_value = {}  # state -> value
+        self.states_value = np.zeros(3 ** 9, dtype=np.float32)  # state -> value, indexed by board_key
+        self.replay = None  # ReplayBuffer keeping the rewarded games, None when off
 
     def getHash(self, board):
-        boardHash = str(board.reshape(BOARD_COLS * BOARD_ROWS))
+        boardHash = board_key(board)
         return boardHash
 
     def chooseAction(self, positions, current_board, symbol):
@@ -208,16 +396,12 @@ class Agent:
             idx = np.random.choice(len(positions))
             action = positions[idx]
         else:
-            value_max = -999
-            for p in positions:
-                next_board = current_board.copy()
-                next_board[p] = symbol
-                next_boardHash = self.getHash(next_board)
-                value = 0 if self.states_value.get(next_boardHash) is None else self.states_value.get(next_boardHash)
-                # print("value", value)
-                if value >= value_max:
-                    value_max = value
-                    action = p
+            # board numbers after each move are the current one plus the digit of symbol on the cell
+            cells = [p[0] * BOARD_COLS + p[1] for p in positions]
+            next_codes = board_code(current_board) + symbol % 3 * POWERS_OF_3[cells]
+            values = self.states_value[CANONICAL_KEYS[next_codes]]
+            # last of the best moves, as when comparing them one by one
+            action = positions[len(values) - 1 - int(np.argmax(values[::-1]))]
         # print("{} takes action {}".format(self.name, action))
         return action
 
@@ -227,24 +411,53 @@ class Agent:
 
     # at the end of game, backpropagate and update states value
     def feedReward(self, reward):
+        if self.replay is not None:
+            self.replay.add(self.states, reward)
+        values = self.states_value
         for st in reversed(self.states):
-            if self.states_value.get(st) is None:
-                self.states_value[st] = 0
-            self.states_value[st] += self.lr * (self.decay_gamma * reward - self.states_value[st])
-            reward = self.states_value[st]
+            value = values.item(st)
+            values[st] = value + self.lr * (self.decay_gamma * reward - value)
+            reward = values.item(st)
+
+    # learn again from stored games, the largest value change of a game becomes its priority
+    def replayGames(self, count=None):
+        replay = self.replay
+        slots = replay.sample(count)
+        values = self.states_value
+        priorities = []
+        for slot in slots.tolist():
+            states, reward = replay.episode(slot)
+            change = 0.0
+            for st in reversed(states.tolist()):
+                value = values.item(st)
+                values[st] = value + self.lr * (self.decay_gamma * reward - value)
+                reward = values.item(st)
+                change = max(change, abs(reward - value))
+            priorities.append(change)
+        replay.update_priorities(slots, priorities)
+        return len(slots)
 
     def reset(self):
         self.states = []
 
     def savePolicy(self):
-        fw = open('new_policy_' + str(self.name), 'wb')
-        pickle.dump(self.states_value, fw)
-        fw.close()
+        np.save('new_policy_' + str(self.name) + '.npy', self.states_value)
 
-    def loadPolicy(self, file):
-        fr = open(file, 'rb')
-        self.states_value = pickle.load(fr)
-        fr.close()
+    def loadPolicy(self, file, mmap=False):
+        # mmap opens the policy read-only, for playing without training
+        with open(file, 'rb') as f:
+            is_npy = f.read(6) == b'\x93NUMPY'
+        if is_npy:
+            self.states_value = np.load(file, mmap_mode='r' if mmap else None)
+            return
+        # Policy files and pickles written by older versions
+        keys, values = load_policy(file, key_fn=self.legacyHash).items_arrays()
+        self.states_value = np.zeros(3 ** 9, dtype=np.float32)
+        self.states_value[keys.astype(np.int64)] = values
+
+    def legacyHash(self, boardHash):
+        # Policies pickled by older versions keyed the board by its printed array
+        return board_key(np.array(boardHash.strip('[]').split(), dtype=float))
 
 
 class HumanPlayer:
@@ -272,22 +485,45 @@ class HumanPlayer:
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--report-every", type=int, default=0,
+                        help="print games/s, moves/s, table sizes and time per phase every N games, 0 is off")
+    parser.add_argument("--profile", metavar="FIRST:LAST",
+                        help="run games FIRST to LAST under cProfile, also turns the phase timers on")
+    parser.add_argument("--profile-output", default="profile.out", help="file receiving the cProfile stats")
+    parser.add_argument("--replay", type=int, default=0, metavar="STATES",
+                        help="keep the last games of each agent in a replay buffer of this many states, 0 is off")
+    parser.add_argument("--replay-batch", type=int, default=8, help="stored games replayed after each new game")
+    parser.add_argument("--prioritized", action="store_true", help="replay the games whose values moved most more often")
+    args = parser.parse_args()
+
     # training
     num_games = 100 # Number of games you want your agents to play.
     p1 = Agent("p1")
     p2 = Agent("p2")
+    if args.replay:
+        p1.replay = ReplayBuffer(args.replay, batch_size=args.replay_batch, prioritized=args.prioritized)
+        p2.replay = ReplayBuffer(args.replay, batch_size=args.replay_batch, prioritized=args.prioritized)
     #
-    st = State(p1, p2)
+    st = BatchState(p1, p2)  # State(p1, p2) plays the games one at a time
+    if args.report_every or args.profile:
+        st.stats = Instrumentation(report_every=args.report_every,
+                                   profile_window=tuple(int(x) for x in args.profile.split(":")) if args.profile else None,
+                                   profile_path=args.profile_output,
+                                   tables=lambda: {"p1": np.count_nonzero(p1.states_value),
+                                                   "p2": np.count_nonzero(p2.states_value)})
     print("training...")
     st.play(num_games)
+    if st.stats is not None:
+        st.stats.close()
     print("Saving the policies...")
     p1.savePolicy()
     p2.savePolicy()
 
     print("Lets Play....")
     p1 = Agent("computer", exp_rate=0)
-    p1.loadPolicy("new_policy_p1")
-    print(len(p1.states_value))
+    p1.loadPolicy("new_policy_p1.npy")
+    print(np.count_nonzero(p1.states_value))
     p2 = HumanPlayer("human")
 
     st = State(p1, p2)
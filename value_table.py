@@ -0,0 +1,526 @@
+import os
+import pickle
+import struct
+import time
+import numpy as np
+
+HASH_MULTIPLIER = 0x9E3779B97F4A7C15  # Fibonacci hashing, spreads sequential keys over the table
+MAX_LOAD = 0.75
+PROBE_WINDOW = 16  # slots checked at once by the batched lookups
+SMALL_BATCH = 32  # get_many looks up fewer keys one by one
+
+
+class ValueTable:
+    def __init__(self, capacity=1024):
+        '''
+        State -> value table backed by NumPy arrays: open addressing with linear probing,
+        uint64 keys and float32 values, about 12 bytes per slot. Empty slots hold a NaN value.
+        Offers the dict operations the agents use (get, [], in, len, items) plus batched lookups.
+
+        :param capacity: initial number of slots, rounded up to a power of two.
+        '''
+        self.capacity = 1 << max(4, (capacity - 1).bit_length())
+        self.keys = np.zeros(self.capacity, dtype=np.uint64)
+        self.values = np.full(self.capacity, np.nan, dtype=np.float32)
+        self.count = 0
+        self.stats = None  # Instrumentation timing the resizes, None when off
+        self.changed = None  # Flag of the slots changed since the last take_changes, None until it is called
+
+    @classmethod
+    def from_dict(cls, states_value):
+        '''
+        Build a table from a dict with integer keys.
+
+        :param states_value: dict state -> value.
+        :return: ValueTable instance.
+        '''
+        keys = np.fromiter(states_value.keys(), dtype=np.uint64, count=len(states_value))
+        values = np.fromiter(states_value.values(), dtype=np.float32, count=len(states_value))
+        return cls.from_arrays(keys, values)
+
+    @classmethod
+    def from_arrays(cls, keys, values):
+        '''
+        Build a table from arrays of distinct keys and their values.
+
+        :param keys: uint64 array of keys.
+        :param values: array of values.
+        :return: ValueTable instance.
+        '''
+        table = cls(int(len(keys) / MAX_LOAD) + 1)
+        if len(keys):
+            slots = table.find_slots(keys, insert=True)
+            table.values[slots] = values
+        return table
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, key):
+        return self.slot(key) >= 0
+
+    def __getitem__(self, key):
+        s = self.slot(key)
+        if s < 0:
+            raise KeyError(key)
+        return self.values.item(s)
+
+    def __setitem__(self, key, value):
+        s = self.slot(key)
+        if s < 0:
+            s = self.insert(key)
+        self.values[s] = value
+        if self.changed is not None:
+            self.changed[s] = True
+
+    def __getstate__(self):
+        # Only the occupied slots are pickled
+        keys, values = self.items_arrays()
+        return {'keys': keys, 'values': values}
+
+    def __setstate__(self, state):
+        self.__init__(int(len(state['keys']) / MAX_LOAD) + 1)
+        if len(state['keys']):
+            slots = self.find_slots(state['keys'], insert=True)
+            self.values[slots] = state['values']
+
+    def get(self, key, default=None):
+        s = self.slot(key)
+        if s < 0:
+            return default
+        return self.values.item(s)
+
+    def update(self, key, target, lr):
+        '''
+        Move the value of a key towards a target, starting from 0 for a new key.
+
+        :param key: state key.
+        :param target: value to move towards.
+        :param lr: learning rate.
+        :return: the new value as stored.
+        '''
+        s = self.slot(key)
+        if s < 0:
+            s = self.insert(key)
+        value = self.values.item(s)
+        self.values[s] = value + lr * (target - value)
+        if self.changed is not None:
+            self.changed[s] = True
+        return self.values.item(s)
+
+    def items_arrays(self):
+        '''
+        Get all the entries.
+
+        :return: (uint64 array of keys, float32 array of values).
+        '''
+        used = ~np.isnan(self.values)
+        return self.keys[used], self.values[used]
+
+    def items(self):
+        keys, values = self.items_arrays()
+        return zip(keys.tolist(), values.tolist())
+
+    def nbytes(self):
+        return self.keys.nbytes + self.values.nbytes
+
+    def take_changes(self):
+        '''
+        Get the entries added or changed since the previous call, for delta checkpoints.
+        The first call returns all the entries and starts tracking the changes.
+
+        :return: (uint64 array of keys, float32 array of values), copies.
+        '''
+        if self.changed is None:
+            self.changed = np.zeros(self.capacity, dtype=bool)
+            return self.items_arrays()
+        slots = np.flatnonzero(self.changed)
+        self.changed[slots] = False
+        return self.keys[slots], self.values[slots]
+
+    def home_slot(self, key):
+        return ((key * HASH_MULTIPLIER) & 0xFFFFFFFFFFFFFFFF) >> (64 - self.capacity.bit_length() + 1)
+
+    def slot(self, key):
+        '''
+        Find the slot of a key.
+
+        :param key: state key, an integer in [0, 2 ** 64).
+        :return: slot index, or -1 if the key is missing.
+        '''
+        keys, values = self.keys, self.values
+        mask = self.capacity - 1
+        s = self.home_slot(key)
+        while True:
+            value = values.item(s)
+            if value != value:  # NaN, empty slot
+                return -1
+            if keys.item(s) == key:
+                return s
+            s = (s + 1) & mask
+
+    def insert(self, key):
+        '''
+        Add a missing key, growing the table when it gets too full.
+
+        :param key: state key, an integer in [0, 2 ** 64).
+        :return: slot index of the key, holding the value 0.
+        '''
+        if self.count + 1 > self.capacity * MAX_LOAD:
+            self.resize(self.capacity * 2)
+        values = self.values
+        mask = self.capacity - 1
+        s = self.home_slot(key)
+        while values.item(s) == values.item(s):
+            s = (s + 1) & mask
+        self.keys[s] = key
+        self.values[s] = 0
+        self.count += 1
+        if self.changed is not None:
+            self.changed[s] = True
+        return s
+
+    def resize(self, capacity):
+        '''
+        Move all the entries to a new table of the given number of slots.
+
+        :param capacity: number of slots, rounded up to a power of two.
+        :return: None.
+        '''
+        stats = self.stats
+        if stats is not None:
+            start = time.perf_counter()
+        used = ~np.isnan(self.values)
+        keys, values = self.keys[used], self.values[used]
+        changed = None if self.changed is None else self.changed[used]
+        self.__init__(max(capacity, int(len(keys) / MAX_LOAD) + 1))
+        slots = self.find_slots(keys, insert=True)
+        self.values[slots] = values
+        if changed is not None:
+            self.changed = np.zeros(self.capacity, dtype=bool)
+            self.changed[slots[changed]] = True
+        self.stats = stats
+        if stats is not None:
+            stats.add('table_growth', time.perf_counter() - start)
+
+    def find_slots(self, keys, insert=False):
+        '''
+        Find the slots of many keys at once, probing all of them in lockstep.
+
+        :param keys: array of uint64 keys.
+        :param insert: add the missing keys with the value 0 instead of reporting them.
+        :return: int64 array of slots, -1 for the missing keys when not inserting.
+        '''
+        keys = np.asarray(keys, dtype=np.uint64)
+        if insert:
+            unique, inverse = np.unique(keys, return_inverse=True)
+            if self.count + len(unique) > self.capacity * MAX_LOAD:
+                self.resize(int((self.count + len(unique)) / MAX_LOAD) + 1)
+            return self.probe(unique, True)[inverse.reshape(keys.shape)]
+        return self.probe(keys, False)
+
+    def probe(self, keys, insert):
+        mask = np.uint64(self.capacity - 1)
+        shift = np.uint64(64 - self.capacity.bit_length() + 1)
+        slots = (keys * np.uint64(HASH_MULTIPLIER)) >> shift
+        if not insert:
+            return self.probe_windows(keys.reshape(-1), slots.reshape(-1)).reshape(keys.shape)
+        found = np.full(keys.shape, -1, dtype=np.int64)
+        pending = np.flatnonzero(np.ones(keys.shape, dtype=bool))
+        flat_keys = keys.reshape(-1)
+        flat_slots = slots.reshape(-1)
+        while len(pending):
+            s = flat_slots[pending].astype(np.int64)
+            empty = np.isnan(self.values[s])
+            hit = ~empty & (self.keys[s] == flat_keys[pending])
+            found.reshape(-1)[pending[hit]] = s[hit]
+            done = hit | empty
+            if insert and empty.any():
+                # Each empty slot goes to one key, the others keep probing
+                claimed = np.flatnonzero(empty)
+                first = np.unique(s[claimed], return_index=True)[1]
+                winners = claimed[first]
+                self.keys[s[winners]] = flat_keys[pending[winners]]
+                self.values[s[winners]] = 0
+                self.count += len(winners)
+                if self.changed is not None:
+                    self.changed[s[winners]] = True
+                found.reshape(-1)[pending[winners]] = s[winners]
+                done = hit.copy()
+                done[winners] = True
+            pending = pending[~done]
+            flat_slots[pending] = (flat_slots[pending] + np.uint64(1)) & mask
+        return found
+
+    def probe_windows(self, keys, slots):
+        # Lookups check PROBE_WINDOW slots of every chain per step, most keys end within the first window
+        mask = self.capacity - 1
+        found = np.full(len(keys), -1, dtype=np.int64)
+        pending = np.arange(len(keys))
+        start = slots.astype(np.int64)
+        offsets = np.arange(PROBE_WINDOW)
+        while len(pending):
+            window = (start[pending, None] + offsets) & mask
+            empty = np.isnan(self.values[window])
+            hit = ~empty & (self.keys[window] == keys[pending, None])
+            stop = hit | empty
+            ended = stop.any(axis=1)
+            first = stop.argmax(axis=1)
+            rows = np.arange(len(pending))
+            hit_first = ended & hit[rows, first]
+            found[pending[hit_first]] = window[rows, first][hit_first]
+            start[pending] += PROBE_WINDOW
+            pending = pending[~ended]
+        return found
+
+    def get_many(self, keys, default=0.0):
+        '''
+        Look up many keys at once.
+
+        :param keys: array of uint64 keys.
+        :param default: value of the missing keys.
+        :return: float32 array of values.
+        '''
+        keys = np.asarray(keys, dtype=np.uint64)
+        if keys.size <= SMALL_BATCH:
+            # Probing one key at a time costs less than the NumPy calls for a few keys
+            get = self.get
+            return np.array([get(key, default) for key in keys.reshape(-1).tolist()],
+                            dtype=np.float32).reshape(keys.shape)
+        slots = self.find_slots(keys)
+        return np.where(slots >= 0, self.values[np.maximum(slots, 0)], np.float32(default))
+
+
+def backup_waves(slots, games, steps, deterministic):
+    '''
+    Group the updates of backup_episodes into waves applied one after the other.
+
+    :param slots: int64 array of value slots, one per update.
+    :param games: game of each update.
+    :param steps: position of each update in its game.
+    :param deterministic: waves reproducing the serial order, instead of one wave per position.
+    :return: int64 array with the wave of each update.
+    '''
+    waves = np.empty(len(slots), dtype=np.int64)
+    if deterministic:
+        # An update waits for the previous one of its game and for the previous one of its slot,
+        # in the serial order: games one after the other, each from its last state to its first
+        last_wave = {}
+        previous = -1
+        game = -1
+        order = np.lexsort((-steps, games))
+        for u, slot, g in zip(order.tolist(), slots[order].tolist(), games[order].tolist()):
+            if g != game:
+                game = g
+                previous = -1
+            wave = max(previous, last_wave.get(slot, -1)) + 1
+            waves[u] = last_wave[slot] = previous = wave
+        return waves
+    # Positions from the last to the first, and the repeats of a slot at one position in game order
+    order = np.lexsort((games, slots, -steps))
+    sorted_steps, sorted_slots = steps[order], slots[order]
+    starts = np.flatnonzero(np.r_[True, (sorted_steps[1:] != sorted_steps[:-1])
+                                  | (sorted_slots[1:] != sorted_slots[:-1])])
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order)) - np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+    combined = (steps.max() - steps) * (rank.max() + 1) + rank
+    waves[:] = np.unique(combined, return_inverse=True)[1].reshape(-1)
+    return waves
+
+
+def backup_episodes(table, states, lengths, rewards, lr, decay_gamma, deterministic=False):
+    '''
+    feedReward for a batch of finished games: each state from the last to the first moves towards
+    decay_gamma times the reward, the reward becoming its new value. The updates are grouped in waves
+    of distinct slots and applied with NumPy gathers and scatters.
+
+    By default a wave is one position of the games, counted from the start, and a state met several
+    times at a position is updated once per game in game order, so no update is lost. With deterministic,
+    the waves follow the dependencies of the serial order and the values come out exactly as with
+    feedReward called game after game, at the cost of more and smaller waves when games share states.
+
+    :param table: ValueTable, or a float array indexed by the state keys themselves.
+    :param states: (games, max length) array of state keys, the entries past the lengths are ignored.
+    :param lengths: number of states of each game.
+    :param rewards: final reward of each game.
+    :param lr: learning rate.
+    :param decay_gamma: decay of the reward between two states.
+    :return: None.
+    '''
+    states = np.asarray(states)
+    lengths = np.asarray(lengths)
+    valid = np.arange(states.shape[1]) < lengths[:, None]
+    games, steps = np.nonzero(valid)
+    if not len(games):
+        return
+    if isinstance(table, ValueTable):
+        slots = table.find_slots(states[games, steps], insert=True)
+        values = table.values
+        if table.changed is not None:
+            table.changed[slots] = True
+    else:
+        slots = states[games, steps].astype(np.int64)
+        values = table
+    waves = backup_waves(slots, games, steps, deterministic)
+    order = np.argsort(waves, kind='stable')
+    bounds = np.flatnonzero(np.diff(waves[order])) + 1
+    rewards = np.array(rewards, dtype=np.float64)
+    for wave in np.split(order, bounds):
+        s, g = slots[wave], games[wave]
+        value = values[s].astype(np.float64)
+        values[s] = value + lr * (decay_gamma * rewards[g] - value)
+        rewards[g] = values[s]
+
+
+POLICY_MAGIC = b'RLPOLICY'
+POLICY_VERSION = 1
+# magic, version, reserved, number of entries; followed by the sorted uint64 keys and their float32 values
+POLICY_HEADER = struct.Struct('<8sIIQ')
+
+
+class MappedValueTable:
+    def __init__(self, path):
+        '''
+        Read-only state -> value table opened straight from a policy file with mmap.
+        Lookups binary search the sorted keys, so only the pages holding the queried
+        entries are read and processes opening the same file share the page cache.
+
+        :param path: policy file written by save_policy.
+        '''
+        with open(path, 'rb') as f:
+            count = read_policy_header(f, path)
+        self.path = path
+        self.count = count
+        if count:
+            self.keys = np.memmap(path, dtype=np.uint64, mode='r', offset=POLICY_HEADER.size, shape=(count,))
+            self.values = np.memmap(path, dtype=np.float32, mode='r', offset=POLICY_HEADER.size + 8 * count,
+                                    shape=(count,))
+        else:
+            self.keys = np.zeros(0, dtype=np.uint64)
+            self.values = np.zeros(0, dtype=np.float32)
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, key):
+        return self.slot(key) >= 0
+
+    def __getitem__(self, key):
+        s = self.slot(key)
+        if s < 0:
+            raise KeyError(key)
+        return self.values.item(s)
+
+    def __setitem__(self, key, value):
+        raise TypeError('MappedValueTable is read-only, load the policy without mmap to train it.')
+
+    def update(self, key, target, lr):
+        raise TypeError('MappedValueTable is read-only, load the policy without mmap to train it.')
+
+    def get(self, key, default=None):
+        s = self.slot(key)
+        if s < 0:
+            return default
+        return self.values.item(s)
+
+    def slot(self, key):
+        s = int(np.searchsorted(self.keys, np.uint64(key)))
+        if s < self.count and self.keys.item(s) == key:
+            return s
+        return -1
+
+    def find_slots(self, keys):
+        keys = np.asarray(keys, dtype=np.uint64)
+        slots = np.minimum(np.searchsorted(self.keys, keys), max(self.count - 1, 0))
+        if not self.count:
+            return np.full(keys.shape, -1, dtype=np.int64)
+        return np.where(self.keys[slots] == keys, slots, -1).astype(np.int64)
+
+    def get_many(self, keys, default=0.0):
+        slots = self.find_slots(keys)
+        if not self.count:
+            return np.full(slots.shape, default, dtype=np.float32)
+        return np.where(slots >= 0, self.values[np.maximum(slots, 0)], np.float32(default))
+
+    def items_arrays(self):
+        return np.asarray(self.keys), np.asarray(self.values)
+
+    def items(self):
+        keys, values = self.items_arrays()
+        return zip(keys.tolist(), values.tolist())
+
+
+def read_policy_header(f, path):
+    magic, version, reserved, count = POLICY_HEADER.unpack(f.read(POLICY_HEADER.size))
+    if magic != POLICY_MAGIC:
+        raise ValueError('{} is not a policy file.'.format(path))
+    if version != POLICY_VERSION:
+        raise ValueError('{} has policy format version {}, expected {}.'.format(path, version, POLICY_VERSION))
+    return count
+
+
+def is_policy_file(path):
+    with open(path, 'rb') as f:
+        return f.read(len(POLICY_MAGIC)) == POLICY_MAGIC
+
+
+def save_policy(path, states_value):
+    '''
+    Write a state -> value table as a policy file: a header, then the sorted keys and their values.
+    The file is written next to path and renamed, so readers never see a partial policy.
+
+    :param path: output file.
+    :param states_value: ValueTable, MappedValueTable or dict with integer keys.
+    :return: None.
+    '''
+    if isinstance(states_value, dict):
+        states_value = ValueTable.from_dict(states_value)
+    keys, values = states_value.items_arrays()
+    order = np.argsort(keys, kind='stable')
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(POLICY_HEADER.pack(POLICY_MAGIC, POLICY_VERSION, 0, len(keys)))
+        f.write(np.ascontiguousarray(keys[order], dtype='<u8').tobytes())
+        f.write(np.ascontiguousarray(values[order], dtype='<f4').tobytes())
+    os.replace(tmp, path)
+
+
+def load_policy(path, mmap=False, key_fn=None):
+    '''
+    Load a state -> value table from a policy file, or from a pickle written by older versions.
+
+    :param path: policy file.
+    :param mmap: open the file read-only with mmap instead of copying it into memory.
+    :param key_fn: maps the keys of a pickled dict (e.g. old string keys) to integer keys.
+    :return: MappedValueTable when mmap is set and the file is a policy file, else ValueTable.
+    '''
+    if is_policy_file(path):
+        table = MappedValueTable(path)
+        if mmap:
+            return table
+        states_value = ValueTable(int(len(table) / MAX_LOAD) + 1)
+        if len(table):
+            slots = states_value.find_slots(table.keys, insert=True)
+            states_value.values[slots] = table.values
+        return states_value
+    with open(path, 'rb') as f:
+        states_value = pickle.load(f)
+    if isinstance(states_value, dict):
+        if key_fn is not None:
+            states_value = {key_fn(key): value for key, value in states_value.items()}
+        states_value = ValueTable.from_dict(states_value)
+    return states_value
+
+
+def convert_policy(src, dst, key_fn=None):
+    '''
+    Convert a pickled policy into a policy file.
+
+    :param src: pickled dict or ValueTable.
+    :param dst: output policy file.
+    :param key_fn: maps the keys of a pickled dict to integer keys.
+    :return: number of entries written.
+    '''
+    states_value = load_policy(src, key_fn=key_fn)
+    save_policy(dst, states_value)
+    return len(states_value)